@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # OCRA: Ocean Chemistry with Reacktoro And beyond
+# ### This Python code implements Reaktoro software to calculate ocean chemistry
+#
+# ## Reference: Hakim et al. (2023) ApJL
+#
+# ### benchmark.py # times the solve and sweep hot paths of OCRA
+#
+# Usage:
+#   python benchmark.py                            # run all benchmarks, write bench_output.json
+#   python benchmark.py --only solve_Ca pH_run     # run some benchmarks
+#   python benchmark.py --compare old.json new.json
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from inputs import BENCH_DEFAULTS, GRID_DEFAULTS
+
+
+def _inputs(num, seed):
+    '''
+    Returns num random points of PCO2 [bar], Temp [K] and totP [bar] on the OCRA grid ranges
+    '''
+    rng = np.random.default_rng(seed)
+    PCO2s = 10**rng.uniform(-8, -0.5, num)
+    Temps = rng.uniform(273.16, 372.16, num)
+    totPs = 10**rng.uniform(0, np.log10(5000), num)
+    return PCO2s, Temps, totPs
+
+def _additions(PCO2, Temp, nSiO2 = 1, nDIV = 1, beta = 0.3):
+    '''
+    Returns DIV and SiO2 additions of the weathering flux at PCO2 [bar] and Temp [K]
+    '''
+    from store import numden, weath_scaling
+    addDIVtot = nDIV * weath_scaling(PCO2, Temp, beta=beta) / numden
+    return addDIVtot, nSiO2 * addDIVtot
+
+def _fns(DIV):
+    import solve, store
+    return getattr(solve, 'setup_' + DIV), getattr(solve, 'solve_' + DIV), getattr(store, 'save_chems3_' + DIV)
+
+
+def bench_solve(DIV, num, seed, **kwargs):
+    '''
+    Returns number of points and seconds of num single solve_Ca/Mg/Fe calls at random points
+    '''
+    setup_fn, solve_fn, save_fn = _fns(DIV)
+    system, specs, solver = setup_fn()
+    PCO2s, Temps, totPs = _inputs(num, seed)
+    start = time.perf_counter()
+    for j in range(num):
+        addDIVtot, addSiO2 = _additions(PCO2s[j], Temps[j])
+        solve_fn(system, specs, solver, addDIVtot, addSiO2, PCO2s[j], Temps[j], totPs[j])
+    return num, time.perf_counter() - start
+
+def bench_save(DIV, num, seed, **kwargs):
+    '''
+    Returns number of points and seconds of num save_chems3_Ca/Mg/Fe calls into a chems3 cube
+    '''
+    from store import chem_dict3
+    setup_fn, solve_fn, save_fn = _fns(DIV)
+    system, specs, solver = setup_fn()
+    PCO2s, Temps, totPs = _inputs(num, seed)
+    states = []
+    for j in range(num):
+        addDIVtot, addSiO2 = _additions(PCO2s[j], Temps[j])
+        states.append(solve_fn(system, specs, solver, addDIVtot, addSiO2, PCO2s[j], Temps[j], totPs[j]))
+    chems3 = chem_dict3(1, 1, num, DIV = DIV)
+    start = time.perf_counter()
+    for j in range(num):
+        chems3 = save_fn(states[j], PCO2s[j], chems3, 0, j, 0) # chems3[0][0][j]
+    return num, time.perf_counter() - start
+
+def bench_CCD(numQ, totnum, **kwargs):
+    '''
+    Returns number of points and seconds of a numQ x numQ x totnum CaCCD_PCO2_T sweep
+    '''
+    from ocra import CaCCD_PCO2_T
+    start = time.perf_counter()
+    CaCCD_PCO2_T(totnum = totnum, numQ1 = numQ, numQ2 = numQ, plot_flag = False, table_flag = False,
+                 skip_flag = False, checkpoint = 0)
+    return numQ * numQ * totnum, time.perf_counter() - start
+
+def bench_pH(numPCO2, **kwargs):
+    '''
+    Returns number of points and seconds of PH._run over numPCO2 PCO2s and its three weathering cases
+    '''
+    from ph import PH
+    from solve import setup_Ca, solve_Ca
+    ph = PH(DIV = 'Ca', totnum = numPCO2, comparison = None)
+    PCO2s = GRID_DEFAULTS["pco2s"](numPCO2)
+    start = time.perf_counter()
+    ph._run(PCO2s, setup_Ca, solve_Ca)
+    return 3 * numPCO2, time.perf_counter() - start
+
+def bench_phases(numPCO2, **kwargs):
+    '''
+    Returns number of points and seconds of phases_PCO2 over numPCO2 PCO2s
+    '''
+    from ocra import phases_PCO2
+    start = time.perf_counter()
+    phases_PCO2(DIV = 'Ca', totnum = numPCO2, plot_flag = False, table_flag = False)
+    return numPCO2, time.perf_counter() - start
+
+
+BENCHMARKS = {
+    'solve_Ca': lambda **kw: bench_solve('Ca', **kw),
+    'solve_Mg': lambda **kw: bench_solve('Mg', **kw),
+    'solve_Fe': lambda **kw: bench_solve('Fe', **kw),
+    'save_chems3_Ca': lambda **kw: bench_save('Ca', **kw),
+    'save_chems3_Mg': lambda **kw: bench_save('Mg', **kw),
+    'save_chems3_Fe': lambda **kw: bench_save('Fe', **kw),
+    'CaCCD_PCO2_T': bench_CCD,
+    'pH_run': bench_pH,
+    'phases_PCO2': bench_phases,
+}
+
+
+def run_benchmark(name, repeat = BENCH_DEFAULTS["repeat"], **kwargs):
+    '''
+    Returns timings of the benchmark name in this process, best of repeat runs
+    '''
+    from cache import disable_cache, disable_memo
+    disable_cache() # time the solves, not the cache
+    disable_memo()
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()): # drop the progress output of the sweeps
+        for r in range(repeat):
+            num, seconds = BENCHMARKS[name](**kwargs)
+            times.append(seconds)
+    best = min(times)
+    return {
+        'points': num,
+        'seconds': times,
+        'best': best,
+        'points_per_sec': num / best,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, # kB on Linux
+    }
+
+def _version():
+    '''
+    Returns Reaktoro version and git commit of this checkout
+    '''
+    try:
+        import reaktoro
+        rkt = getattr(reaktoro, '__version__', 'unknown')
+    except ImportError:
+        rkt = None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return {'reaktoro': rkt, 'commit': commit, 'python': platform.python_version(), 'machine': platform.machine()}
+
+def run_benchmarks(names = None, path = BENCH_DEFAULTS["path"], **kwargs):
+    '''
+    Returns results of the benchmarks names (all by default), each in a fresh process so that its
+    peak RSS is its own, and writes them as JSON to path
+    '''
+    if names is None:
+        names = list(BENCHMARKS)
+    params = dict(BENCH_DEFAULTS)
+    params.pop("path")
+    params.update(kwargs)
+
+    results = {}
+    for name in names:
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', name, json.dumps(params)],
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            print('%-16s failed:\n%s' % (name, proc.stderr.strip()))
+            results[name] = {'error': proc.stderr.strip().splitlines()[-1:]}
+            continue
+        results[name] = json.loads(proc.stdout.strip().splitlines()[-1])
+        print('%-16s %10.1f points/sec %8.1f MB peak RSS'
+              % (name, results[name]['points_per_sec'], results[name]['peak_rss_mb']))
+
+    output = {'version': _version(), 'params': params, 'results': results}
+    if path is not None:
+        with open(path, 'w') as f:
+            json.dump(output, f, indent=2)
+        print('Wrote %s' % path)
+    return output
+
+def compare_benchmarks(old_path, new_path):
+    '''
+    Prints the speedup and RSS change of each benchmark from the JSON output old_path to new_path
+    '''
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    if old['params'] != new['params']:
+        print('Warning: benchmark parameters differ')
+    print('%-16s %12s %12s %8s %10s' % ('benchmark', 'old pts/s', 'new pts/s', 'speedup', 'RSS [MB]'))
+    for name in old['results']:
+        a, b = old['results'][name], new['results'].get(name, {})
+        if 'points_per_sec' not in a or 'points_per_sec' not in b:
+            print('%-16s %12s' % (name, 'missing'))
+            continue
+        print('%-16s %12.1f %12.1f %7.2fx %4.0f->%-5.0f'
+              % (name, a['points_per_sec'], b['points_per_sec'], b['points_per_sec'] / a['points_per_sec'],
+                 a['peak_rss_mb'], b['peak_rss_mb']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the solve and sweep hot paths of OCRA')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='benchmarks to run')
+    parser.add_argument('--output', default=BENCH_DEFAULTS["path"], help='JSON file of the results')
+    parser.add_argument('--repeat', type=int, default=BENCH_DEFAULTS["repeat"], help='runs per benchmark')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two JSON files')
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        name, params = args.child
+        print(json.dumps(run_benchmark(name, **json.loads(params))))
+    elif args.compare is not None:
+        compare_benchmarks(*args.compare)
+    else:
+        run_benchmarks(args.only, path=args.output, repeat=args.repeat)
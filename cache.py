@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # OCRA: Ocean Chemistry with Reacktoro And beyond
+# ### This Python code implements Reaktoro software to calculate ocean chemistry
+# 
+# ## Reference: Hakim et al. (2023) ApJL
+# 
+# ### cache.py # contains a persistent cache of solved equilibrium points
+
+# Import libraries
+
+import atexit
+import hashlib
+import sqlite3
+from collections import OrderedDict
+
+import numpy as np
+
+from inputs import CACHE_DEFAULTS, MEMO_DEFAULTS
+
+
+class SolveCache:
+    '''
+    Species amounts of solved points keyed by content hash, in an in-memory LRU on top of an SQLite file
+    '''
+    def __init__(self, path = CACHE_DEFAULTS["path"], maxsize = CACHE_DEFAULTS["maxsize"]):
+        self.path = path
+        self.maxsize = maxsize
+        self.memory = OrderedDict()
+        self.hits = 0       # served from memory
+        self.disk_hits = 0  # served from disk
+        self.misses = 0
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path, timeout = 60)
+            self.db.execute('PRAGMA journal_mode=WAL')     # concurrent readers and one writer at a time
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            self.db.execute('CREATE TABLE IF NOT EXISTS points (key TEXT PRIMARY KEY, amounts BLOB)')
+            self.db.commit()
+
+    def _remember(self, key, amounts):
+        self.memory[key] = amounts
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.maxsize:
+            self.memory.popitem(last = False)
+
+    def get(self, key):
+        '''
+        Returns species amounts [mol] stored under key, or None
+        '''
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits = self.hits + 1
+            return self.memory[key]
+        if self.db is not None:
+            row = self.db.execute('SELECT amounts FROM points WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                amounts = np.frombuffer(row[0], dtype = np.float64)
+                self._remember(key, amounts)
+                self.disk_hits = self.disk_hits + 1
+                return amounts
+        self.misses = self.misses + 1
+        return None
+
+    def put(self, key, amounts):
+        '''
+        Stores species amounts [mol] under key
+        '''
+        amounts = np.array(amounts, dtype = np.float64)
+        self._remember(key, amounts)
+        if self.db is not None:
+            self.db.execute('INSERT OR REPLACE INTO points VALUES (?, ?)', (key, amounts.tobytes()))
+            self.db.commit()
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+
+_active = {'cache': None}
+
+def enable_cache(path = CACHE_DEFAULTS["path"], maxsize = CACHE_DEFAULTS["maxsize"]):
+    '''
+    Returns the cache in front of solve_Ca/Mg/Fe, stored in the SQLite file path (None for memory only)
+    '''
+    disable_cache()
+    _active['cache'] = SolveCache(path = path, maxsize = maxsize)
+    return _active['cache']
+
+def disable_cache():
+    '''
+    Closes and removes the cache in front of solve_Ca/Mg/Fe
+    '''
+    if _active['cache'] is not None:
+        _active['cache'].close()
+    _active['cache'] = None
+
+def active_cache():
+    '''
+    Returns the active cache or None
+    '''
+    return _active['cache']
+
+def cache_config():
+    '''
+    Returns (path, maxsize) of the active cache to enable it again in another process, or None
+    '''
+    cache = _active['cache']
+    if cache is None:
+        return None
+    return cache.path, cache.maxsize
+
+_session = {'memo': None}
+
+def enable_memo(maxsize = MEMO_DEFAULTS["maxsize"]):
+    '''
+    Returns the in-memory memo of the points solved in this session, checked before the cache
+    '''
+    _session['memo'] = SolveCache(path = None, maxsize = maxsize)
+    return _session['memo']
+
+def disable_memo():
+    '''
+    Removes the memo of the points solved in this session
+    '''
+    _session['memo'] = None
+
+def active_memo():
+    '''
+    Returns the active memo or None
+    '''
+    return _session['memo']
+
+def memo_counts():
+    '''
+    Returns hits and misses of the memo of this session, zero without a memo
+    '''
+    memo = _session['memo']
+    if memo is None:
+        return 0, 0
+    return memo.hits, memo.misses
+
+def memo_summary():
+    '''
+    Prints hits and misses of the memo of this session
+    '''
+    memo = _session['memo']
+    if memo is None:
+        return
+    total = memo.hits + memo.misses
+    if total > 0:
+        print('Session memo: %d of %d solves served from memory (%.1f%% hit rate)'
+              % (memo.hits, total, 100 * memo.hits / total))
+
+if MEMO_DEFAULTS["enabled"] == True:
+    enable_memo()
+atexit.register(memo_summary) # at the end of a run
+
+def point_key(*parts):
+    '''
+    Returns content hash of the inputs of an equilibrium point, with floats hashed exactly
+    '''
+    def exact(part):
+        if isinstance(part, (int, float, np.integer, np.floating)) and not isinstance(part, bool):
+            return float(part).hex() # 0 and 0.0 are the same input
+        if isinstance(part, (list, tuple)):
+            return tuple(exact(p) for p in part)
+        return part
+    return hashlib.sha256(repr(exact(parts)).encode()).hexdigest()
+
+def cache_summary():
+    '''
+    Prints hits and misses of the active cache
+    '''
+    cache = _active['cache']
+    if cache is None:
+        return
+    total = cache.hits + cache.disk_hits + cache.misses
+    if total > 0:
+        print('Cache: %d memory hits, %d disk hits, %d misses (%.1f%% hit rate)'
+              % (cache.hits, cache.disk_hits, cache.misses, 100 * (total - cache.misses) / total))
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # OCRA: Ocean Chemistry with Reacktoro And beyond
+# ### This Python code implements Reaktoro software to calculate ocean chemistry
+# 
+# ## Reference: Hakim et al. (2023) ApJL
+# 
+# ### emulator.py # contains functions to tabulate solved ocean chemistry and interpolate it at arbitrary inputs
+
+# Import libraries
+
+import json
+import itertools
+
+import numpy as np
+
+from inputs import EMULATOR_DEFAULTS, GRID_DEFAULTS
+from store import *
+from solve import *
+
+
+AXES = ['PCO2', 'Temp', 'totP', 'nDIV', 'nSiO2']
+LOG_AXES = [True, False, True, True, False] # interpolate PCO2, totP and nDIV in log10
+
+SETUPS = {
+    'Ca': (setup_Ca, solve_Ca, save_chems1_Ca),
+    'Mg': (setup_Mg, solve_Mg, save_chems1_Mg),
+    'Fe': (setup_Fe, solve_Fe, save_chems1_Fe),
+}
+
+
+def emulator_fields(DIV):
+    '''
+    Returns names of the quantities tabulated for DIV, as stored by save_chems1
+    '''
+    return [DIV+'+2', 'H+', 'OH-', 'CO3-2', 'HCO3-', 'SiO2(aq)', 'CO2(aq)', 'CO2(g)'] + MINERALS[DIV][:2] + ['pH']
+
+
+# Solve ocean chemistry at a list of points
+
+def _solve_points(DIV, PCO2, Temp, totP, nDIV, nSiO2):
+    '''
+    Returns chems1 dictionary object with the solved points given as 1D arrays of inputs
+    '''
+    setup_fn, solve_fn, save_fn = SETUPS[DIV]
+    system, specs, solver = setup_fn()
+
+    chems1 = chem_dict1(len(PCO2), DIV = DIV)
+    for j in range(len(PCO2)):
+        addDIVtot = nDIV[j] / numden
+        addSiO2 = nSiO2[j] * addDIVtot
+        state = solve_fn(system, specs, solver, addDIVtot, addSiO2, PCO2[j], Temp[j], totP[j])
+        chems1 = save_fn(state, PCO2[j], chems1, j)
+
+    return chems1
+
+
+# Build, load and query interpolation tables
+
+def build_emulator(
+    DIV = EMULATOR_DEFAULTS["DIV"],
+    PCO2s = None,
+    Temps = None,
+    totPs = None,
+    nDIVs = EMULATOR_DEFAULTS["nDIVs"],
+    nSiO2s = EMULATOR_DEFAULTS["nSiO2s"],
+    path = EMULATOR_DEFAULTS["path"],
+    numtest = EMULATOR_DEFAULTS["numtest"],
+):
+    '''
+    Solves DIV over the grid PCO2s [bar] x Temps [K] x totPs [bar] x nDIVs x nSiO2s, writes the table to
+    path.npy and path.json (emulator_DIV by default), and returns the maximum interpolation error of each
+    field at numtest random points
+    '''
+    if DIV != 'Ca' and DIV != 'Mg' and DIV != 'Fe':
+        print('Error: Enter DIV = "Ca" or "Mg" or "Fe"')
+        return
+    if path is None:
+        path = 'emulator_' + DIV
+
+    if PCO2s is None:
+        PCO2s = GRID_DEFAULTS["pco2s"](EMULATOR_DEFAULTS["numPCO2"])
+    if Temps is None:
+        Temps = GRID_DEFAULTS["temps"](EMULATOR_DEFAULTS["numT"])
+    if totPs is None:
+        totPs = GRID_DEFAULTS["totps"](EMULATOR_DEFAULTS["numP"])
+    axes = [np.sort(np.asarray(axis, dtype=float)) for axis in (PCO2s, Temps, totPs, nDIVs, nSiO2s)]
+    shape = tuple(len(axis) for axis in axes)
+
+    points = np.array(list(itertools.product(*axes))) # C order, last axis fastest
+    chems1 = _solve_points(DIV, *points.T)
+
+    fields = emulator_fields(DIV)
+    data = np.stack([chems1[field] for field in fields], axis=-1).reshape(shape + (len(fields),))
+    log_fields = [bool(field != 'pH' and np.all(chems1[field] > 0)) for field in fields] # minerals can be 0
+    for m, log_field in enumerate(log_fields):
+        if log_field:
+            data[..., m] = np.log10(data[..., m])
+
+    np.save(path + '.npy', data.astype(np.float32))
+    meta = {
+        'DIV': DIV,
+        'axes': {name: axis.tolist() for name, axis in zip(AXES, axes)},
+        'fields': fields,
+        'log_fields': log_fields,
+    }
+
+    emulator = load_emulator(path, meta = meta)
+    errors = emulator_error(emulator, numtest = numtest)
+    meta['max_error'] = errors
+    with open(path + '.json', 'w') as f:
+        json.dump(meta, f, indent = 1)
+
+    print('Maximum interpolation error versus direct solves at %d points:' % numtest)
+    for field, error in errors.items():
+        print('    %s: %.3g' % (field, error))
+
+    return errors
+
+def load_emulator(path = EMULATOR_DEFAULTS["path"], meta = None, DIV = EMULATOR_DEFAULTS["DIV"]):
+    '''
+    Returns emulator dictionary with the table of path.npy (emulator_DIV by default) memory-mapped read-only,
+    shared between processes
+    '''
+    if path is None:
+        path = 'emulator_' + DIV
+    if meta is None:
+        with open(path + '.json') as f:
+            meta = json.load(f)
+
+    emulator = dict(meta)
+    emulator['axes'] = [np.array(meta['axes'][name]) for name in AXES]
+    emulator['data'] = np.load(path + '.npy', mmap_mode = 'r')
+
+    return emulator
+
+def query_emulator(emulator, PCO2, Temp, totP, nDIV, nSiO2):
+    '''
+    Returns dictionary of the tabulated fields at broadcast arrays of PCO2 [bar], Temp [K], totP [bar], nDIV and
+    nSiO2 by multilinear interpolation in log space, clamped to the table range
+    '''
+    coords = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (PCO2, Temp, totP, nDIV, nSiO2)])
+    shape = coords[0].shape
+
+    lower = []
+    weights = []
+    for axis, x, log_axis in zip(emulator['axes'], coords, LOG_AXES):
+        if log_axis:
+            axis, x = np.log10(axis), np.log10(x)
+        x = x.ravel()
+        if len(axis) == 1:
+            lower.append(np.zeros(x.shape, dtype=int))
+            weights.append(np.zeros(x.shape))
+            continue
+        i = np.clip(np.searchsorted(axis, x) - 1, 0, len(axis) - 2)
+        lower.append(i)
+        weights.append(np.clip((x - axis[i]) / (axis[i+1] - axis[i]), 0, 1))
+
+    data = emulator['data']
+    values = 0
+    for corner in itertools.product((0, 1), repeat = len(AXES)):
+        index = tuple(np.minimum(i + c, n - 1) for i, c, n in zip(lower, corner, data.shape))
+        weight = np.prod([w if c else 1 - w for w, c in zip(weights, corner)], axis = 0)
+        values = values + weight[:, None] * data[index]
+
+    result = {}
+    for m, (field, log_field) in enumerate(zip(emulator['fields'], emulator['log_fields'])):
+        if log_field:
+            result[field] = (10**values[:, m]).reshape(shape)
+        else:
+            result[field] = values[:, m].reshape(shape)
+
+    return result
+
+def emulator_error(emulator, numtest = EMULATOR_DEFAULTS["numtest"], seed = 0):
+    '''
+    Returns maximum absolute error of each emulator field against direct solves at numtest random points
+    '''
+    rng = np.random.default_rng(seed)
+    inputs = []
+    for axis, log_axis in zip(emulator['axes'], LOG_AXES):
+        if log_axis:
+            inputs.append(10**rng.uniform(np.log10(axis[0]), np.log10(axis[-1]), numtest))
+        else:
+            inputs.append(rng.uniform(axis[0], axis[-1], numtest))
+
+    chems1 = _solve_points(emulator['DIV'], *inputs)
+    values = query_emulator(emulator, *inputs)
+
+    return {field: float(np.max(np.abs(values[field] - chems1[field]))) for field in emulator['fields']}
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # OCRA: Ocean Chemistry with Reacktoro And beyond
+# ### This Python code implements Reaktoro software to calculate ocean chemistry
+#
+# ## Reference: Hakim et al. (2023) ApJL
+#
+# ### export.py # contains functions to export and load full sweep cubes in binary formats
+
+# Import libraries
+
+import json
+import os
+
+import numpy as np
+
+from inputs import EXPORT_DEFAULTS
+
+try:
+    import h5py
+except ImportError: # only needed for the HDF5 format
+    h5py = None
+
+
+class ChemFile:
+    '''
+    Exported Chemical Dictionary with lazy dictionary-style access to the species, the grid values along
+    each axis in coords and the sweep inputs in attrs
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.h5 = None
+        if os.path.isdir(path):
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+            self.names = meta['names']
+            self.attrs = meta['attrs']
+            self.coords = {axis: np.load(os.path.join(path, 'coord_' + axis + '.npy')) for axis in meta['axes']}
+        else:
+            if h5py is None:
+                raise ImportError('Reading %s requires h5py' % path)
+            self.h5 = h5py.File(path, 'r')
+            self.names = json.loads(self.h5.attrs['names'])
+            self.attrs = json.loads(self.h5.attrs['attrs'])
+            axes = json.loads(self.h5.attrs['axes'])
+            self.coords = {axis: self.h5['coords'][axis][...] for axis in axes}
+
+    def __getitem__(self, name):
+        '''
+        Returns the array of name, memory-mapped (.npy) or as an HDF5 dataset read only where it is sliced
+        '''
+        if name not in self.names:
+            raise KeyError(name)
+        if self.h5 is not None:
+            return self.h5['species'][name]
+        return np.load(os.path.join(self.path, _file_name(name)), mmap_mode = 'r')
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def keys(self):
+        return list(self.names)
+
+    def close(self):
+        if self.h5 is not None:
+            self.h5.close()
+            self.h5 = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def _file_name(name):
+    '''
+    Returns .npy file name of the species name
+    '''
+    return name.replace('/', '_') + '.npy'
+
+def export_chems(path, chems, coords, attrs = None, fmt = EXPORT_DEFAULTS["format"],
+                 compression = EXPORT_DEFAULTS["compression"]):
+    '''
+    Writes all species of chems with the grid values along each of its axes (coords, e.g. {'Temp': Temps,
+    'PCO2': PCO2s, 'totP': totPs}) to path, as one chunked and compressed HDF5 file (fmt = 'h5') or as a
+    directory of memory-mappable .npy files (fmt = 'npy'), and returns path
+    '''
+    shape = chems.data.shape[1:]
+    if tuple(len(values) for values in coords.values()) != shape:
+        print('Error: coords do not match the shape %s of chems' % (shape,))
+        return
+    attrs = {} if attrs is None else attrs
+
+    if fmt == 'h5':
+        if h5py is None:
+            print('Error: Install h5py to export in HDF5 format, or use fmt = "npy"')
+            return
+        chunks = (1,) + shape[1:] if len(shape) > 1 else None # one slice of the first axis per chunk
+        tmp = path + '.tmp'
+        with h5py.File(tmp, 'w') as f:
+            f.attrs['names'] = json.dumps(list(chems))
+            f.attrs['axes'] = json.dumps(list(coords))
+            f.attrs['attrs'] = json.dumps(attrs, default = float)
+            for axis, values in coords.items():
+                f.create_dataset('coords/' + axis, data = np.asarray(values))
+            for name in chems:
+                f.create_dataset('species/' + name, data = chems[name], chunks = chunks,
+                                 compression = 'gzip', compression_opts = compression, shuffle = True)
+        os.replace(tmp, path)
+
+    elif fmt == 'npy':
+        os.makedirs(path, exist_ok = True)
+        for axis, values in coords.items():
+            np.save(os.path.join(path, 'coord_' + axis + '.npy'), np.asarray(values))
+        for name in chems:
+            np.save(os.path.join(path, _file_name(name)), chems[name])
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'names': list(chems), 'axes': list(coords), 'attrs': attrs}, f, indent = 2, default = float)
+
+    else:
+        print('Error: Enter fmt = "h5" or "npy"')
+        return
+
+    print('Exported %d species on a %s grid to %s' % (len(chems), ' x '.join(str(n) for n in shape), path))
+
+    return path
+
+def load_chems(path):
+    '''
+    Returns ChemFile of an exported sweep, which reads species lazily from path
+    '''
+    return ChemFile(path)
@@ -14,6 +14,9 @@ PH_DEFAULTS = {
     "table_flag": True,
     "analytical_flag": False,
     "comparison": "PCO2",
+    "continuation": False,
+    "stats_flag": False,    # write solver statistics as a table and heatmap
+    "retry_flag": False,    # retry failed solves, see RETRY_DEFAULTS
 }
 
 
@@ -26,6 +29,24 @@ CCD_DEFAULTS = {
     "numQ2": 10,
     "plot_flag": True,
     "table_flag": True,
+    "workers": 1,
+    "continuation": False,
+    "stats_flag": False,    # write solver statistics per (T, PCO2) column as a table and heatmap
+    "retry_flag": False,    # retry failed solves, see RETRY_DEFAULTS
+    "ccd_mode": "grid",     # "grid" scans all totnum pressures, "root" searches the threshold crossing
+    "ccd_xtol": 1e-2,       # tolerance of the "root" search in log10(P [bar])
+    "skip_flag": True,      # stop solving a column once its CCD is fixed
+    "dtype": np.float64,    # np.float32 halves the memory of the species cube
+    "checkpoint": 300,      # seconds between checkpoints of solved columns, 0 disables them
+    "resume": False,        # continue from the checkpoint of an interrupted sweep
+    "adaptive": False,      # refine a coarse (T, PCO2) grid only where the CCD changes
+    "adapt_step": 8,        # grid stride of the coarse (T, PCO2) grid of the adaptive mode
+    "adapt_tol": 0.1,       # largest difference in log10(CCD) between corners of an unrefined cell
+    "export": None,         # "h5" or "npy" writes the full species cube with its grid
+    "reduce": None,         # "ccd" keeps only the CCD of each column, "surface" also its surface pH and carbonate
+    "thresholds": (0.001,), # fractions of the surface carbonate left at each depth map, the first is the CCD
+    "maps_flag": False,     # write maps of pH and the carbonate species at the pressure map_totP
+    "map_totP": 1,          # pressure [bar] of the species maps, the nearest grid pressure is used
 }
 
 
@@ -37,6 +58,8 @@ PHASE_DEFAULTS = {
     "totnum": 20,
     "plot_flag": True,
     "table_flag": True,
+    "stats_flag": False,
+    "retry_flag": False,
 }
 
 
@@ -45,3 +68,68 @@ GRID_DEFAULTS = {
     "pco2s": lambda size: np.logspace(-8, -0.5, num=size),
     "totps": lambda size: np.logspace(0, np.log10(5000), num=size),
 }
+
+
+LOGK_DEFAULTS = {
+    "numT": 100,
+    "numP": 100,
+    "path": "logK_table.npz", # None keeps the table in memory only
+}
+
+
+EMULATOR_DEFAULTS = {
+    "DIV": "Ca",
+    "numPCO2": 16,
+    "numT": 8,
+    "numP": 8,
+    "nDIVs": np.logspace(-2, 2, num=5),
+    "nSiO2s": np.array([0, 1]),
+    "path": None,           # None writes emulator_<DIV>.npy and emulator_<DIV>.json
+    "numtest": 20,
+}
+
+
+CACHE_DEFAULTS = {
+    "path": "ocra_cache.sqlite", # None keeps solved points in memory only
+    "maxsize": 100000,           # points kept in memory
+}
+
+
+MEMO_DEFAULTS = {
+    "enabled": True,   # serve points solved before in this session from memory
+    "maxsize": 100000, # points kept in memory
+}
+
+
+EXPORT_DEFAULTS = {
+    "format": "h5",    # "h5" (chunked, compressed, needs h5py) or "npy" (memory-mapped)
+    "compression": 4,  # gzip level of the HDF5 format
+}
+
+
+RETRY_DEFAULTS = {
+    "maxiters": 1000,  # solver iterations of the second retry
+    "substeps": 8,     # steps in PCO2 and P from the last converged point of the third retry
+}
+
+
+RENDER_DEFAULTS = {
+    "rasterize": False, # rasterize contourf layers in batch rendering
+    "dpi": 300,         # resolution of rasterized layers
+}
+
+
+RUNNER_DEFAULTS = {
+    "workers": 4,      # figure jobs run at the same time
+}
+
+
+BENCH_DEFAULTS = {
+    "seed": 0,
+    "repeat": 3,
+    "num": 50,        # points of the single solve and save_chems3 benchmarks
+    "numQ": 4,        # (T, PCO2) grid of the CCD benchmark
+    "totnum": 10,     # pressures of the CCD benchmark
+    "numPCO2": 20,    # PCO2s of the PH._run and phases_PCO2 benchmarks
+    "path": "bench_output.json",
+}
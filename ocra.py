@@ -10,73 +10,521 @@
 
 # Import libraries
 
+import os
+import json
+import time
+import hashlib
+
 import numpy as np
 import pandas as pd
 
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
 from inputs import CCD_DEFAULTS, PHASE_DEFAULTS, GRID_DEFAULTS
 from store import *
 from solve import *
 from output import *
+from export import export_chems
 
-# Calculate Ca-CCD as a function of PCO2 and T
+# Solve pressure columns of the CCD sweep, serially or on a process pool
 
-def CaCCD_PCO2_T(
+_worker = {} # chemical setup of a pool worker process
+
+def _init_worker(setup_fn, cache = None):
+    '''
+    Builds the chemical setup once in each worker process and opens its own connection to the solve cache
+    '''
+    _worker['setup'] = setup_fn()
+    if cache is not None:
+        enable_cache(*cache)
+
+def _solve_column(setup, addDIVtot, addSiO2, PCO2, Temp, DIV, solve_fn, save_fn, carb, totPs, continuation = False,
+                  skip_flag = True, retry_flag = False, thresholds = (0.001,)):
+    '''
+    Returns chems3 dictionary object of shape (1, 1, totnum) with the pressure column at (Temp, PCO2),
+    the stats records of each solved pressure and the depths [km] of the column at each of thresholds
+    '''
+    system, specs, solver = setup
+    column = chem_dict3(1, 1, len(totPs), DIV = DIV)
+    records = np.zeros((len(totPs), len(STATS)))
+    state0 = None # last converged state, if continuation is on
+    good = {} if retry_flag == True else None
+    j = 0
+    while j < len(totPs):
+        totP = totPs[j]
+        state, result = solve_fn(system, specs, solver, addDIVtot, addSiO2, PCO2, Temp, totP,
+                                 state0 = state0, result_flag = True, good = good)
+        if continuation == True and result.succeeded():
+            state0 = state
+        column = save_fn(state, PCO2, column, 0, j, 0)
+        records[j] = stats_record(result)
+        j = j + 1
+        if skip_flag == True: # the CCD is fixed once the surface has no carbonate or carbonate has dissolved
+            nCarb_surf = column[carb][0][0][0]
+            if nCarb_surf < low_cutoff or column[carb][0][0][j-1] < min(thresholds) * nCarb_surf:
+                break
+    column.data[:, 0, 0, j:] = np.nan # pressures left unsolved
+    return column, records[:j], np.array([ccd_depth(column[carb][0][0], totPs, fraction) for fraction in thresholds])
+
+def _root_column(setup, addDIVtot, addSiO2, PCO2, Temp, DIV, solve_fn, save_fn, carb, totPs, continuation = False,
+                 xtol = 1e-2, retry_flag = False, thresholds = (0.001,)):
+    '''
+    Returns chems3 dictionary object of shape (1, 1, totnum) with the surface point at (Temp, PCO2),
+    the stats records of each solve and the depths [km] at each of thresholds found by bisection in log10(P)
+    '''
+    system, specs, solver = setup
+    column = chem_dict3(1, 1, len(totPs), DIV = DIV)
+    records = []
+    state0 = None # last converged state, if continuation is on
+    good = {} if retry_flag == True else None
+
+    def solve_P(totP):
+        nonlocal state0
+        state, result = solve_fn(system, specs, solver, addDIVtot, addSiO2, PCO2, Temp, totP,
+                                 state0 = state0, result_flag = True, good = good)
+        records.append(stats_record(result))
+        if continuation == True and result.succeeded():
+            state0 = state
+        return state
+
+    column = save_fn(solve_P(totPs[0]), PCO2, column, 0, 0, 0)
+    column.data[:, 0, 0, 1:] = np.nan # only the surface is stored
+    nCarb_surf = column[carb][0][0][0]
+    if nCarb_surf < low_cutoff:
+        return column, np.array(records), np.full(len(thresholds), 1e-3) # km
+
+    logP0, logP1 = np.log10(totPs[0]), np.log10(totPs[-1])
+    known = {logP0: nCarb_surf, logP1: numden * solve_P(totPs[-1]).speciesAmount(carb)[0]} # carbonate by log10(P)
+    depths = np.zeros(len(thresholds))
+    for m, fraction in enumerate(thresholds):
+        level = fraction * nCarb_surf
+        if known[logP1] >= level: # no crossing down to the deepest pressure
+            depths[m] = 100 # km
+            continue
+        # narrowest bracket of the crossing among the pressures solved so far, also for earlier thresholds
+        lo = max(logP for logP in known if known[logP] >= level)
+        hi = min(logP for logP in known if logP > lo)
+        while hi - lo > xtol:
+            mid = (lo + hi) / 2
+            known[mid] = numden * solve_P(10**mid).speciesAmount(carb)[0]
+            if known[mid] >= level:
+                lo = mid
+            else:
+                hi = mid
+        depths[m] = ocean_depth(10**((lo + hi) / 2))
+
+    return column, np.array(records), depths
+
+def _reduce_column(setup, *args, column_fn, names):
+    '''
+    Returns dictionary object of shape (1, 1, 1) with only the surface values of names of the pressure column
+    solved by column_fn, its stats records and CCD [km]
+    '''
+    column, records, CCD = column_fn(setup, *args)
+    surface = ChemDict(names, (1, 1, 1), dtype = column.data.dtype)
+    surface.data[...] = column.data[column.rows(names), :, :, :1]
+    return surface, records, CCD
+
+def _column_task(column_fn, task):
+    '''
+    Returns grid indices and pressure column solved with the setup of this worker process
+    '''
+    k, i = task[:2]
+    return k, i, column_fn(_worker['setup'], *task[2:])
+
+def _checkpoint_path(name, params):
+    '''
+    Returns checkpoint path of the sweep with inputs params, e.g. fig3a.1b2c3d4e.ckpt.npz, so that sweeps with
+    other inputs do not replace or remove it
+    '''
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True, default=float).encode()).hexdigest()
+    return name + '.' + digest[:8] + '.ckpt.npz'
+
+def _save_checkpoint(path, params, done, chems3, CCDs, stats):
+    '''
+    Writes the solved columns of a CCD sweep to path atomically, via a temporary file that replaces path
+    '''
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, params=json.dumps(params, default=float), done=done, data=chems3.data, CCDs=CCDs,
+                 stats=stats.data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def _load_checkpoint(path, params):
+    '''
+    Returns solved columns, species data, CCDs and solver statistics from the checkpoint at path, or None if it is missing
+    or belongs to other inputs
+    '''
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as saved: # closed before the next checkpoint replaces path
+        if json.loads(str(saved['params'])) != params:
+            print('Ignoring %s, which was written for other inputs' % path)
+            return None
+        return saved['done'], saved['data'], saved['CCDs'], saved['stats']
+
+def _column_fn(DIV, solve_fn, save_fn, carb, totPs, continuation, ccd_mode, ccd_xtol, skip_flag, retry_flag,
+               thresholds):
+    '''
+    Returns function that solves one pressure column of the CCD sweep in ccd_mode, or None
+    '''
+    if ccd_mode == 'grid':
+        return partial(_solve_column, DIV = DIV, solve_fn = solve_fn, save_fn = save_fn, carb = carb, totPs = totPs,
+                       continuation = continuation, skip_flag = skip_flag, retry_flag = retry_flag,
+                       thresholds = thresholds)
+    elif ccd_mode == 'root':
+        return partial(_root_column, DIV = DIV, solve_fn = solve_fn, save_fn = save_fn, carb = carb, totPs = totPs,
+                       continuation = continuation, xtol = ccd_xtol, retry_flag = retry_flag,
+                       thresholds = thresholds)
+    print('Error: Enter ccd_mode = "grid" or "root"')
+    return None
+
+def _reduced_names(reduce, carb):
+    '''
+    Returns the species kept at the surface of each column in reduce mode, or None to keep whole columns
+    '''
+    if reduce == 'ccd':
+        return []
+    elif reduce == 'surface':
+        return map_species(carb)
+    return None
+
+def _map_pressure(totPs, map_totP):
+    '''
+    Returns index and value [bar] of the grid pressure of totPs nearest to map_totP [bar] in log10
+    '''
+    jmap = int(np.argmin(np.abs(np.log10(totPs) - np.log10(map_totP))))
+    return jmap, totPs[jmap]
+
+def _stats_coords(Temps, PCO2s, totnum, ccd_mode):
+    '''
+    Returns grid values along each axis of the solver statistics of a CCD sweep, per point in grid mode
+    and per (T, PCO2) column in root mode
+    '''
+    if ccd_mode == 'grid':
+        return {'Temp': Temps, 'PCO2': PCO2s, 'totP': GRID_DEFAULTS["totps"](totnum)}
+    return {'Temp': Temps, 'PCO2': PCO2s}
+
+def _column_tasks(points, Temps, PCO2s, beta, nSiO2, nDIV):
+    '''
+    Returns tasks of grid indices and inputs of the pressure columns at the (k, i) points
+    '''
+    tasks = []
+    for k, i in points:
+        Temp, PCO2 = Temps[k], PCO2s[i]
+        addDIVtot = nDIV * weath_scaling(PCO2, Temp, beta=beta) / numden
+        addSiO2 = nSiO2 * addDIVtot
+        tasks.append((k, i, addDIVtot, addSiO2, PCO2, Temp))
+    return tasks
+
+def _CCD_PCO2_T(DIV, setup_fn, solve_fn, save_fn, carb, beta, nSiO2, nDIV, totnum, numQ1, numQ2, workers, continuation,
+                ccd_mode, ccd_xtol, skip_flag, dtype, checkpoint, resume, adaptive, adapt_step, adapt_tol, retry_flag,
+                export, reduce, thresholds, map_totP):
+    '''
+    Returns PCO2s [bar], Temps [K], depths [km] of the carbonate carb at each of thresholds, of shape
+    (len(thresholds), numQ1, numQ2), and maps of the map_species at the grid pressure nearest to map_totP [bar]
+    '''
+    if totnum > 10 and ccd_mode == 'grid':
+        print('Please be patient. A high-resolution figure is being generated.')
+        
+    Temps = GRID_DEFAULTS["temps"](numQ1) # Temperature in K
+    PCO2s = GRID_DEFAULTS["pco2s"](numQ2) # surface CO2 pressure in bar
+    totPs = GRID_DEFAULTS["totps"](totnum)
+
+    CCDs = np.zeros((len(thresholds), numQ1, numQ2))
+    maps = ChemDict(map_species(carb), (numQ1, numQ2))
+    jmap, _ = _map_pressure(totPs, map_totP)
+    stats_shape = (numQ1, numQ2, totnum) if ccd_mode == 'grid' else (numQ1, numQ2) # per point or per column
+
+    column_fn = _column_fn(DIV, solve_fn, save_fn, carb, totPs, continuation, ccd_mode, ccd_xtol, skip_flag,
+                           retry_flag, thresholds)
+    if column_fn is None:
+        return PCO2s, Temps, CCDs, maps, stats_dict(stats_shape)
+
+    names = _reduced_names(reduce, carb)
+    if reduce is not None and names is None:
+        print('Error: Enter reduce = None or "ccd" or "surface"')
+        return PCO2s, Temps, CCDs, maps, stats_dict(stats_shape)
+
+    if names is None:
+        chems3 = chem_dict3(numQ1, numQ2, totnum, DIV = DIV, dtype = dtype)
+    else: # each column is reduced as soon as it is solved, so memory does not grow with totnum
+        chems3 = ChemDict(names, (numQ1, numQ2, 1), dtype = dtype)
+        column_fn = partial(_reduce_column, column_fn = column_fn, names = names)
+
+    sweep = {
+        'chems3': chems3,
+        'CCDs': CCDs,
+        'done': np.zeros((numQ1, numQ2), dtype=bool), # columns already solved
+        'stats': stats_dict(stats_shape), # NaN where skipped or interpolated
+        'skipped': 0,
+        'params': {'DIV': DIV, 'beta': beta, 'nSiO2': nSiO2, 'nDIV': nDIV, 'totnum': totnum, 'numQ1': numQ1,
+                   'numQ2': numQ2, 'ccd_mode': ccd_mode, 'ccd_xtol': ccd_xtol, 'skip_flag': skip_flag,
+                   'dtype': np.dtype(dtype).str, 'adaptive': adaptive, 'adapt_step': adapt_step,
+                   'adapt_tol': adapt_tol, 'retry_flag': retry_flag, 'reduce': reduce,
+                   'thresholds': list(thresholds)},
+        'checkpoint': checkpoint,
+        'saved_at': time.time(),
+    }
+    sweep['path'] = _checkpoint_path(CCD_name(DIV, nSiO2), sweep['params']) # next to the CSV table
+    if resume == True:
+        saved = _load_checkpoint(sweep['path'], sweep['params'])
+        if saved is not None:
+            sweep['done'], chems3.data[...], CCDs[...], sweep['stats'].data[...] = saved
+            print('Resuming from %s with %d of %d columns solved'
+                  % (sweep['path'], np.sum(sweep['done']), sweep['done'].size))
+
+    def solve(points):
+        tasks = _column_tasks([(k, i) for k, i in points if not sweep['done'][k][i]], Temps, PCO2s, beta, nSiO2, nDIV)
+        _solve_columns(tasks, column_fn, setup_fn, workers, sweep)
+
+    if adaptive == True:
+        _adaptive_columns(solve, CCDs, sweep['done'], adapt_step, adapt_tol)
+        chems3.data[:, ~sweep['done']] = np.nan # columns interpolated instead of solved
+    else:
+        solve([(k, i) for k in range(numQ1) for i in range(numQ2)])
+
+    if checkpoint > 0 and os.path.exists(sweep['path']): # the sweep is complete
+        os.remove(sweep['path'])
+
+    output_stats(sweep['stats'], continuation = continuation, skipped = sweep['skipped'])
+    if adaptive == True:
+        print('Adaptive refinement solved %d of %d columns' % (np.sum(sweep['done']), sweep['done'].size))
+
+    if export is not None: # the full cube or its surface in reduce mode, e.g. fig3a_chems.h5
+        path = CCD_name(DIV, nSiO2) + '_chems' + ('.h5' if export == 'h5' else '')
+        export_chems(path, chems3, {'Temp': Temps, 'PCO2': PCO2s, 'totP': totPs[:chems3.data.shape[-1]]},
+                     attrs = sweep['params'], fmt = export)
+
+    if reduce is not None and not (reduce == 'surface' and jmap == 0):
+        maps.data[...] = np.nan
+        print('Warning: reduce = "%s" keeps no species at %g bar for the maps' % (reduce, totPs[jmap]))
+    elif ccd_mode == 'root' and jmap > 0:
+        maps.data[...] = np.nan
+        print('Warning: ccd_mode = "root" solves no grid pressure at %g bar for the maps' % totPs[jmap])
+    else: # species of the sweep, no extra solves
+        maps.data[...] = chems3.data[chems3.rows(maps.names), :, :, jmap]
+        empty = np.sum(np.isnan(maps.data).all(axis = 0)) # interpolated by adaptive or skipped by skip_flag
+        if empty > 0:
+            print('Warning: %d of %d (T, PCO2) points were not solved at %g bar and are empty in the maps'
+                  % (empty, numQ1 * numQ2, totPs[jmap]))
+
+    return PCO2s, Temps, CCDs, maps, sweep['stats']
+
+def _stream_columns(tasks, column_fn, setup_fn, workers):
+    '''
+    Yields grid indices, column, stats records and CCD of the columns of tasks in task order, as soon as
+    each column is solved, serially or on a process pool
+    '''
+    pool = None
+    if workers > 1: # columns are independent, so each worker solves whole columns
+        chunksize = max(1, len(tasks) // (4 * workers))
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                   initargs=(setup_fn, cache_config()))
+        columns = pool.map(partial(_column_task, column_fn), tasks, chunksize=chunksize)
+    else:
+        setup = setup_fn()
+        columns = ((task[0], task[1], column_fn(setup, *task[2:])) for task in tasks)
+
+    try:
+        for k, i, (column, records, CCD) in columns:
+            yield k, i, column, records, CCD
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+def _solve_columns(tasks, column_fn, setup_fn, workers, sweep):
+    '''
+    Solves the columns of tasks and stores them in the sweep dictionary with periodic checkpoints
+    '''
+    chems3, CCDs, done, stats = sweep['chems3'], sweep['CCDs'], sweep['done'], sweep['stats']
+    totnum = sweep['params']['totnum']
+
+    columns = _stream_columns(tasks, column_fn, setup_fn, workers)
+    try:
+        for k, i, column, records, CCD in columns:
+            chems3.data[:, k, i] = column.data[:, 0, 0]
+            if stats.data.ndim == 4: # grid mode, one record per solved pressure
+                stats.data[:, k, i, :len(records)] = np.transpose(records)
+            else: # root mode, records of the bisection solves
+                stats.data[:, k, i] = reduce_stats(records)
+            sweep['skipped'] = sweep['skipped'] + max(0, totnum - len(records))
+            CCDs[:, k, i] = CCD
+            done[k][i] = True
+            if sweep['checkpoint'] > 0 and time.time() - sweep['saved_at'] > sweep['checkpoint']:
+                _save_checkpoint(sweep['path'], sweep['params'], done, chems3, CCDs, stats)
+                sweep['saved_at'] = time.time()
+    except BaseException:
+        if sweep['checkpoint'] > 0:
+            _save_checkpoint(sweep['path'], sweep['params'], done, chems3, CCDs, stats)
+        raise
+    finally:
+        columns.close()
+
+def _column_points(DIV, k, i, column, records, PCO2, Temp, totPs, ccd_mode):
+    '''
+    Yields Point of each solved pressure saved in a column at grid indices (k, i)
+    '''
+    rows = column.rows(SPECIES[DIV])
+    if ccd_mode == 'root': # only the surface is saved, the other records are bisection solves in call order
+        solved = [(0, records[0])]
+    else: # the pressures are solved in grid order until the column stops
+        solved = zip(range(len(records)), records)
+    for j, record in solved:
+        yield Point(DIV, (k, i, j), PCO2, Temp, totPs[j], column.data[rows, 0, 0, j], record)
+
+def _adaptive_columns(solve, CCDs, done, step, tol):
+    '''
+    Solves the columns of a coarse grid with stride step, recursively subdivides cells whose corner CCDs
+    differ by more than tol in log10 at any threshold, and interpolates the CCDs of the remaining columns in log10
+    '''
+    def nodes(num):
+        index = list(range(0, num, step))
+        if index[-1] != num - 1 or num == 1:
+            index.append(num - 1)
+        return index
+
+    ks, iis = nodes(CCDs.shape[1]), nodes(CCDs.shape[2])
+    cells = [(k0, k1, i0, i1) for k0, k1 in zip(ks[:-1], ks[1:]) for i0, i1 in zip(iis[:-1], iis[1:])]
+    final = []
+
+    while len(cells) > 0:
+        solve(sorted({(k, i) for k0, k1, i0, i1 in cells for k in (k0, k1) for i in (i0, i1)}))
+        split = []
+        for k0, k1, i0, i1 in cells:
+            logCCDs = np.log10([CCDs[:, k0, i0], CCDs[:, k0, i1], CCDs[:, k1, i0], CCDs[:, k1, i1]])
+            if np.max(np.ptp(logCCDs, axis=0)) > tol and (k1 - k0 > 1 or i1 - i0 > 1):
+                km, im = (k0 + k1) // 2, (i0 + i1) // 2
+                krange = [(k0, km), (km, k1)] if k1 - k0 > 1 else [(k0, k1)]
+                irange = [(i0, im), (im, i1)] if i1 - i0 > 1 else [(i0, i1)]
+                split = split + [(ka, kb, ia, ib) for ka, kb in krange for ia, ib in irange]
+            else:
+                final.append((k0, k1, i0, i1))
+        cells = split
+
+    for k0, k1, i0, i1 in final: # bilinear in log10(CCD) over the grid indices of the cell
+        logCCDs = np.log10([[CCDs[:, k0, i0], CCDs[:, k0, i1]], [CCDs[:, k1, i0], CCDs[:, k1, i1]]])
+        for k in range(k0, k1 + 1):
+            for i in range(i0, i1 + 1):
+                if done[k][i]:
+                    continue
+                tk = (k - k0) / (k1 - k0) if k1 > k0 else 0
+                ti = (i - i0) / (i1 - i0) if i1 > i0 else 0
+                CCDs[:, k, i] = 10**((1 - tk) * (1 - ti) * logCCDs[0][0] + (1 - tk) * ti * logCCDs[0][1]
+                                  + tk * (1 - ti) * logCCDs[1][0] + tk * ti * logCCDs[1][1])
+
+
+# Stream solved points of a CCD sweep
+
+_CCD_SYSTEMS = {
+    'Ca': (setup_Ca, solve_Ca, save_chems3_Ca, 'Calcite'),
+    'Mg': (setup_Mg, solve_Mg, save_chems3_Mg, 'Magnesite'),
+    'Fe': (setup_Fe, solve_Fe, save_chems3_Fe, 'Siderite'),
+}
+
+def stream_CCD_PCO2_T(
+    DIV = 'Ca',
     beta = CCD_DEFAULTS["beta"],
     nSiO2 = CCD_DEFAULTS["nSiO2"],
     nDIV = CCD_DEFAULTS["nDIV"],
     totnum = CCD_DEFAULTS["totnum"],
     numQ1 = CCD_DEFAULTS["numQ1"],
     numQ2 = CCD_DEFAULTS["numQ2"],
-    plot_flag = CCD_DEFAULTS["plot_flag"],
-    table_flag = CCD_DEFAULTS["table_flag"],
+    workers = CCD_DEFAULTS["workers"],
+    continuation = CCD_DEFAULTS["continuation"],
+    ccd_mode = CCD_DEFAULTS["ccd_mode"],
+    ccd_xtol = CCD_DEFAULTS["ccd_xtol"],
+    skip_flag = CCD_DEFAULTS["skip_flag"],
+    retry_flag = CCD_DEFAULTS["retry_flag"],
+    thresholds = CCD_DEFAULTS["thresholds"],
 ):
     '''
-    Returns Ca-CCD [km] as a function of PCO2 [bar] and Temp [K]
+    Yields Point of each solved (Temp, PCO2, totP) grid point of the CCD sweep of DIV, column by column
+    as soon as each column is solved, with grid indices (k, i, j) into (Temps, PCO2s, totPs)
     '''
-    if totnum > 10:
-        print('Please be patient. A high-resolution figure is being generated.')
-        
+    if DIV not in _CCD_SYSTEMS:
+        print('Error: Enter DIV = "Ca" or "Mg" or "Fe"')
+        return
+    setup_fn, solve_fn, save_fn, carb = _CCD_SYSTEMS[DIV]
+
     Temps = GRID_DEFAULTS["temps"](numQ1) # Temperature in K
     PCO2s = GRID_DEFAULTS["pco2s"](numQ2) # surface CO2 pressure in bar
     totPs = GRID_DEFAULTS["totps"](totnum)
 
-    chems3 = chem_dict3(numQ1, numQ2, totnum)
+    column_fn = _column_fn(DIV, solve_fn, save_fn, carb, totPs, continuation, ccd_mode, ccd_xtol, skip_flag,
+                           retry_flag, thresholds)
+    if column_fn is None:
+        return
+    tasks = _column_tasks([(k, i) for k in range(numQ1) for i in range(numQ2)], Temps, PCO2s, beta, nSiO2, nDIV)
 
-    CCDs = np.zeros((numQ1, numQ2))
-    
-    system, specs, solver = setup_Ca()
-                
-    for k, Temp in enumerate(Temps):
-
-        for i, PCO2 in enumerate(PCO2s):
-            addDIVtot = nDIV * weath_scaling(PCO2, Temp, beta=beta) / numden
-            addSiO2 = nSiO2 * addDIVtot
-            j = 0
-            while j < totnum:
-                totP = totPs[j]
-                state = solve_Ca(system, specs, solver, addDIVtot, addSiO2, PCO2, Temp, totP)
-                chems3 = save_chems3_Ca(state, PCO2, chems3, i, j, k)
-                j = j + 1
-
-    for k, _ in enumerate(Temps):
-        for i in range(len(PCO2s)):
-            nCarb_surf = chems3['Calcite'][k][i][0]
-            if nCarb_surf < low_cutoff:
-                CCDs[k][i] = 1e-3 # 0 # km
-            else:
-                CCDs[k][i] = 100 # km
-            j = 0
-            while j < totnum:
-                if chems3['Calcite'][k][i][j] < 0.001 * nCarb_surf:
-                    CCDs[k][i] = ocean_depth(totPs[j])
-                    j = totnum
-                else:
-                    j = j + 1
+    columns = _stream_columns(tasks, column_fn, setup_fn, workers)
+    try:
+        for k, i, column, records, CCD in columns:
+            yield from _column_points(DIV, k, i, column, records, PCO2s[i], Temps[k], totPs, ccd_mode)
+    finally:
+        columns.close()
+
+
+# Calculate Ca-CCD as a function of PCO2 and T
+
+def CaCCD_PCO2_T(
+    beta = CCD_DEFAULTS["beta"],
+    nSiO2 = CCD_DEFAULTS["nSiO2"],
+    nDIV = CCD_DEFAULTS["nDIV"],
+    totnum = CCD_DEFAULTS["totnum"],
+    numQ1 = CCD_DEFAULTS["numQ1"],
+    numQ2 = CCD_DEFAULTS["numQ2"],
+    plot_flag = CCD_DEFAULTS["plot_flag"],
+    table_flag = CCD_DEFAULTS["table_flag"],
+    workers = CCD_DEFAULTS["workers"],
+    continuation = CCD_DEFAULTS["continuation"],
+    ccd_mode = CCD_DEFAULTS["ccd_mode"],
+    ccd_xtol = CCD_DEFAULTS["ccd_xtol"],
+    skip_flag = CCD_DEFAULTS["skip_flag"],
+    dtype = CCD_DEFAULTS["dtype"],
+    checkpoint = CCD_DEFAULTS["checkpoint"],
+    resume = CCD_DEFAULTS["resume"],
+    adaptive = CCD_DEFAULTS["adaptive"],
+    adapt_step = CCD_DEFAULTS["adapt_step"],
+    adapt_tol = CCD_DEFAULTS["adapt_tol"],
+    stats_flag = CCD_DEFAULTS["stats_flag"],
+    retry_flag = CCD_DEFAULTS["retry_flag"],
+    export = CCD_DEFAULTS["export"],
+    reduce = CCD_DEFAULTS["reduce"],
+    thresholds = CCD_DEFAULTS["thresholds"],
+    maps_flag = CCD_DEFAULTS["maps_flag"],
+    map_totP = CCD_DEFAULTS["map_totP"],
+):
+    '''
+    Returns Ca-CCD [km] as a function of PCO2 [bar] and Temp [K] at each of thresholds, solver statistics
+    per (T, PCO2, P) point (per (T, PCO2) column in root mode) and maps of pH and the carbonate species at map_totP [bar]
+    '''
+    PCO2s, Temps, CCDs, maps, stats = _CCD_PCO2_T('Ca', setup_Ca, solve_Ca, save_chems3_Ca, 'Calcite', beta, nSiO2, nDIV,
+                                     totnum, numQ1, numQ2, workers, continuation,
+                                     ccd_mode, ccd_xtol, skip_flag, dtype, checkpoint, resume,
+                                     adaptive, adapt_step, adapt_tol, retry_flag, export, reduce,
+                                     thresholds, map_totP)
     
-    output_CaCCD_PCO2_T(PCO2s, Temps, CCDs, beta = beta, nSiO2 = nSiO2, nDIV = nDIV,
+    output_CaCCD_PCO2_T(PCO2s, Temps, CCDs[0], beta = beta, nSiO2 = nSiO2, nDIV = nDIV,
                         plot_flag = plot_flag, table_flag = table_flag)
+
+    if len(thresholds) > 1:
+        output_CCD_thresholds(PCO2s, Temps, CCDs, thresholds, CCD_name('Ca', nSiO2),
+                              table_flag = table_flag, plot_flag = plot_flag)
+
+    if maps_flag == True:
+        _, totP = _map_pressure(GRID_DEFAULTS["totps"](totnum), map_totP)
+        output_CCD_maps(PCO2s, Temps, maps, totP, CCD_name('Ca', nSiO2),
+                        table_flag = table_flag, plot_flag = plot_flag)
+
+    if stats_flag == True:
+        output_stats_table(stats, _stats_coords(Temps, PCO2s, totnum, ccd_mode), CCD_name('Ca', nSiO2),
+                           table_flag = table_flag, plot_flag = plot_flag)
         
-    return
+    return CCDs, stats, maps
 
 
 # Calculate Mg-CCD as a function of PCO2 and T
@@ -90,53 +538,52 @@ def MgCCD_PCO2_T(
     numQ2 = CCD_DEFAULTS["numQ2"],
     plot_flag = CCD_DEFAULTS["plot_flag"],
     table_flag = CCD_DEFAULTS["table_flag"],
+    workers = CCD_DEFAULTS["workers"],
+    continuation = CCD_DEFAULTS["continuation"],
+    ccd_mode = CCD_DEFAULTS["ccd_mode"],
+    ccd_xtol = CCD_DEFAULTS["ccd_xtol"],
+    skip_flag = CCD_DEFAULTS["skip_flag"],
+    dtype = CCD_DEFAULTS["dtype"],
+    checkpoint = CCD_DEFAULTS["checkpoint"],
+    resume = CCD_DEFAULTS["resume"],
+    adaptive = CCD_DEFAULTS["adaptive"],
+    adapt_step = CCD_DEFAULTS["adapt_step"],
+    adapt_tol = CCD_DEFAULTS["adapt_tol"],
+    stats_flag = CCD_DEFAULTS["stats_flag"],
+    retry_flag = CCD_DEFAULTS["retry_flag"],
+    export = CCD_DEFAULTS["export"],
+    reduce = CCD_DEFAULTS["reduce"],
+    thresholds = CCD_DEFAULTS["thresholds"],
+    maps_flag = CCD_DEFAULTS["maps_flag"],
+    map_totP = CCD_DEFAULTS["map_totP"],
 ):
     '''
-    Returns Mg-CCD [km] as a function of PCO2 [bar] and Temp [K]
+    Returns Mg-CCD [km] as a function of PCO2 [bar] and Temp [K] at each of thresholds, solver statistics
+    per (T, PCO2, P) point (per (T, PCO2) column in root mode) and maps of pH and the carbonate species at map_totP [bar]
     '''
-    if totnum > 10:
-        print('Please be patient. A high-resolution figure is being generated.')
-        
-    Temps = GRID_DEFAULTS["temps"](numQ1) # Temperature in K
-    PCO2s = GRID_DEFAULTS["pco2s"](numQ2) # surface CO2 pressure in bar
-    totPs = GRID_DEFAULTS["totps"](totnum)
-
-    chems3 = chem_dict3(numQ1, numQ2, totnum)
-
-    CCDs = np.zeros((numQ1, numQ2))
+    PCO2s, Temps, CCDs, maps, stats = _CCD_PCO2_T('Mg', setup_Mg, solve_Mg, save_chems3_Mg, 'Magnesite', beta, nSiO2, nDIV,
+                                     totnum, numQ1, numQ2, workers, continuation,
+                                     ccd_mode, ccd_xtol, skip_flag, dtype, checkpoint, resume,
+                                     adaptive, adapt_step, adapt_tol, retry_flag, export, reduce,
+                                     thresholds, map_totP)
     
-    system, specs, solver = setup_Mg()
-                
-    for k, Temp in enumerate(Temps):
-        for i, PCO2 in enumerate(PCO2s):
-            addDIVtot = nDIV * weath_scaling(PCO2, Temp, beta=beta) / numden
-            addSiO2 = nSiO2 * addDIVtot
-            j = 0
-            while j < totnum:
-                totP = totPs[j]
-                state = solve_Mg(system, specs, solver, addDIVtot, addSiO2, PCO2, Temp, totP)  
-                chems3 = save_chems3_Mg(state, PCO2, chems3, i, j, k)
-                j = j + 1
-
-    for k in range(len(Temps)):
-        for i in range(len(PCO2s)):
-            nCarb_surf = chems3['Magnesite'][k][i][0]
-            if nCarb_surf < low_cutoff:
-                CCDs[k][i] = 1e-3 # 0 # km
-            else:
-                CCDs[k][i] = 100 # km
-            j = 0
-            while j < totnum:
-                if chems3['Magnesite'][k][i][j] < 0.001 * nCarb_surf:
-                    CCDs[k][i] = ocean_depth(totPs[j])
-                    j = totnum
-                else:
-                    j = j + 1
-    
-    output_MgCCD_PCO2_T(PCO2s, Temps, CCDs, beta = beta, nSiO2 = nSiO2, nDIV = nDIV,
+    output_MgCCD_PCO2_T(PCO2s, Temps, CCDs[0], beta = beta, nSiO2 = nSiO2, nDIV = nDIV,
                         plot_flag = plot_flag, table_flag = table_flag)
+
+    if len(thresholds) > 1:
+        output_CCD_thresholds(PCO2s, Temps, CCDs, thresholds, CCD_name('Mg', nSiO2),
+                              table_flag = table_flag, plot_flag = plot_flag)
+
+    if maps_flag == True:
+        _, totP = _map_pressure(GRID_DEFAULTS["totps"](totnum), map_totP)
+        output_CCD_maps(PCO2s, Temps, maps, totP, CCD_name('Mg', nSiO2),
+                        table_flag = table_flag, plot_flag = plot_flag)
+
+    if stats_flag == True:
+        output_stats_table(stats, _stats_coords(Temps, PCO2s, totnum, ccd_mode), CCD_name('Mg', nSiO2),
+                           table_flag = table_flag, plot_flag = plot_flag)
         
-    return
+    return CCDs, stats, maps
 
 # Calculate Fe-CCD as a function of PCO2 and T
 
@@ -149,57 +596,89 @@ def FeCCD_PCO2_T(
     numQ2 = CCD_DEFAULTS["numQ2"],
     plot_flag = CCD_DEFAULTS["plot_flag"],
     table_flag = CCD_DEFAULTS["table_flag"],
+    workers = CCD_DEFAULTS["workers"],
+    continuation = CCD_DEFAULTS["continuation"],
+    ccd_mode = CCD_DEFAULTS["ccd_mode"],
+    ccd_xtol = CCD_DEFAULTS["ccd_xtol"],
+    skip_flag = CCD_DEFAULTS["skip_flag"],
+    dtype = CCD_DEFAULTS["dtype"],
+    checkpoint = CCD_DEFAULTS["checkpoint"],
+    resume = CCD_DEFAULTS["resume"],
+    adaptive = CCD_DEFAULTS["adaptive"],
+    adapt_step = CCD_DEFAULTS["adapt_step"],
+    adapt_tol = CCD_DEFAULTS["adapt_tol"],
+    stats_flag = CCD_DEFAULTS["stats_flag"],
+    retry_flag = CCD_DEFAULTS["retry_flag"],
+    export = CCD_DEFAULTS["export"],
+    reduce = CCD_DEFAULTS["reduce"],
+    thresholds = CCD_DEFAULTS["thresholds"],
+    maps_flag = CCD_DEFAULTS["maps_flag"],
+    map_totP = CCD_DEFAULTS["map_totP"],
 ):
     '''
-    Returns Fe-CCD [km] as a function of PCO2 [bar] and Temp [K]
+    Returns Fe-CCD [km] as a function of PCO2 [bar] and Temp [K] at each of thresholds, solver statistics
+    per (T, PCO2, P) point (per (T, PCO2) column in root mode) and maps of pH and the carbonate species at map_totP [bar]
     '''
-    if totnum > 10:
-        print('Please be patient. A high-resolution figure is being generated.')
-        
-    Temps = GRID_DEFAULTS["temps"](numQ1) # Temperature in K
-    PCO2s = GRID_DEFAULTS["pco2s"](numQ2) # surface CO2 pressure in bar
-    totPs = GRID_DEFAULTS["totps"](totnum)
-
-    chems3 = chem_dict3(numQ1, numQ2, totnum)
-
-    CCDs = np.zeros((numQ1, numQ2))
+    PCO2s, Temps, CCDs, maps, stats = _CCD_PCO2_T('Fe', setup_Fe, solve_Fe, save_chems3_Fe, 'Siderite', beta, nSiO2, nDIV,
+                                     totnum, numQ1, numQ2, workers, continuation,
+                                     ccd_mode, ccd_xtol, skip_flag, dtype, checkpoint, resume,
+                                     adaptive, adapt_step, adapt_tol, retry_flag, export, reduce,
+                                     thresholds, map_totP)
     
-    system, specs, solver = setup_Fe()
-                
-    for k, Temp in enumerate(Temps):
-        for i, PCO2 in enumerate(PCO2s):
-            addDIVtot = nDIV * weath_scaling(PCO2, Temp, beta=beta) / numden
-            addSiO2 = nSiO2 * addDIVtot
-            j = 0
-            while j < totnum:
-                totP = totPs[j]
-                state = solve_Fe(system, specs, solver, addDIVtot, addSiO2, PCO2, Temp, totP)
-                chems3 = save_chems3_Fe(state, PCO2, chems3, i, j, k)
-                j = j + 1
-
-    for k, _ in enumerate(Temps):
-        for i, _ in enumerate(PCO2s):
-            nCarb_surf = chems3['Siderite'][k][i][0]
-            if nCarb_surf < low_cutoff:
-                CCDs[k][i] = 1e-3 # 0 # km
-            else:
-                CCDs[k][i] = 100 # km
-            j = 0
-            while j < totnum:
-                if chems3['Siderite'][k][i][j] < 0.001 * nCarb_surf:
-                    CCDs[k][i] = ocean_depth(totPs[j])
-                    j = totnum
-                else:
-                    j = j + 1
-    
-    output_FeCCD_PCO2_T(PCO2s, Temps, CCDs, beta = beta, nSiO2 = nSiO2, nDIV = nDIV,
+    output_FeCCD_PCO2_T(PCO2s, Temps, CCDs[0], beta = beta, nSiO2 = nSiO2, nDIV = nDIV,
                         plot_flag = plot_flag, table_flag = table_flag)
+
+    if len(thresholds) > 1:
+        output_CCD_thresholds(PCO2s, Temps, CCDs, thresholds, CCD_name('Fe', nSiO2),
+                              table_flag = table_flag, plot_flag = plot_flag)
+
+    if maps_flag == True:
+        _, totP = _map_pressure(GRID_DEFAULTS["totps"](totnum), map_totP)
+        output_CCD_maps(PCO2s, Temps, maps, totP, CCD_name('Fe', nSiO2),
+                        table_flag = table_flag, plot_flag = plot_flag)
+
+    if stats_flag == True:
+        output_stats_table(stats, _stats_coords(Temps, PCO2s, totnum, ccd_mode), CCD_name('Fe', nSiO2),
+                           table_flag = table_flag, plot_flag = plot_flag)
         
-    return
+    return CCDs, stats, maps
 
 
 # Calculate stable phases as a function of PCO2
 
+def stream_phases_PCO2(
+    DIV = PHASE_DEFAULTS["DIV"],
+    Temp = PHASE_DEFAULTS["Temp"],
+    totP = 1,
+    beta = PHASE_DEFAULTS["beta"],
+    nDIV = CCD_DEFAULTS["nDIV"],
+    nSiO2 = PHASE_DEFAULTS["nSiO2"],
+    totnum = PHASE_DEFAULTS["totnum"],
+    retry_flag = PHASE_DEFAULTS["retry_flag"],
+):
+    '''
+    Yields Point of each solved PCO2 [bar] of the stable phases sweep, with grid index (j,) into PCO2s
+    '''
+    if DIV not in _CCD_SYSTEMS:
+        print('Error: Enter DIV = "Ca" or "Mg" or "Fe"')
+        return
+    setup_fn, solve_fn = _CCD_SYSTEMS[DIV][:2]
+
+    PCO2s = GRID_DEFAULTS["pco2s"](totnum) # bar
+    good = {} if retry_flag == True else None
+
+    system, specs, solver = setup_fn()
+
+    j = 0
+    while j < totnum:
+        PCO2 = PCO2s[j]
+        addDIVtot = nDIV * weath_scaling(PCO2,Temp,beta=beta) / numden
+        addSiO2 = nSiO2 * addDIVtot
+        state, result = solve_fn(system, specs, solver, addDIVtot, addSiO2, PCO2, Temp, totP, result_flag = True,
+                                 good = good)
+        yield Point(DIV, (j,), PCO2, Temp, totP, species_record(state, PCO2, DIV), stats_record(result))
+        j = j + 1
+
 def phases_PCO2(
     DIV = PHASE_DEFAULTS["DIV"],
     Temp = PHASE_DEFAULTS["Temp"],
@@ -210,29 +689,26 @@ def phases_PCO2(
     totnum = PHASE_DEFAULTS["totnum"],
     table_flag = PHASE_DEFAULTS["table_flag"],
     plot_flag = PHASE_DEFAULTS["plot_flag"],
+    stats_flag = PHASE_DEFAULTS["stats_flag"],
+    retry_flag = PHASE_DEFAULTS["retry_flag"],
 ):
     '''
-    Returns stable phases as a function of PCO2 [bar]
+    Returns stable phases as a function of PCO2 [bar], and solver statistics per PCO2
     '''  
     if DIV != 'Ca' and DIV != 'Mg' and DIV != 'Fe':
         print('Error: Enter DIV = "Ca" or "Mg" or "Fe"')
+        return
     
     PCO2s = GRID_DEFAULTS["pco2s"](totnum) # bar
-    chems1 = chem_dict1(totnum)
+    chems1 = chem_dict1(totnum, DIV = DIV)
+    stats = stats_dict((totnum,))
+
+    for point in stream_phases_PCO2(DIV = DIV, Temp = Temp, totP = totP, beta = beta, nDIV = nDIV, nSiO2 = nSiO2,
+                                    totnum = totnum, retry_flag = retry_flag):
+        chems1 = save_point(point, chems1, stats)
     
     if DIV == 'Ca':
-        
-        system, specs, solver = setup_Ca()
-
-        j = 0
-        while j < totnum:
-            PCO2 = PCO2s[j]
-            addDIVtot = nDIV * weath_scaling(PCO2,Temp,beta=beta) / numden
-            addSiO2 = nSiO2 * addDIVtot
-            state = solve_Ca(system, specs, solver, addDIVtot, addSiO2, PCO2, Temp, totP)  
-            chems1 = save_chems1_Ca(state, PCO2, chems1, j)
-            j = j + 1
-    
+
         df = pd.DataFrame({
             'Ca++': chems1['Ca+2'],
             'Calcite': chems1['Calcite'],
@@ -245,17 +721,6 @@ def phases_PCO2(
     
     elif DIV == 'Mg':
         
-        system, specs, solver = setup_Mg()
-
-        j = 0
-        while j < totnum:
-            PCO2 = PCO2s[j]
-            addDIVtot = nDIV * weath_scaling(PCO2,Temp,beta=beta) / numden
-            addSiO2 = nSiO2 * addDIVtot
-            state = solve_Mg(system, specs, solver, addDIVtot, addSiO2, PCO2, Temp, totP)
-            chems1 = save_chems1_Mg(state, PCO2, chems1, j)
-            j = j + 1
-
         df = pd.DataFrame({
             'Mg++': chems1['Mg+2'],
             'Magnesite': chems1['Magnesite'],
@@ -267,17 +732,6 @@ def phases_PCO2(
     
     elif DIV == 'Fe':
         
-        system, specs, solver = setup_Fe()
-
-        j = 0
-        while j < totnum:
-            PCO2 = PCO2s[j]
-            addDIVtot = nDIV * weath_scaling(PCO2,Temp,beta=beta) / numden
-            addSiO2 = nSiO2 * addDIVtot
-            state = solve_Fe(system, specs, solver, addDIVtot, addSiO2, PCO2, Temp, totP) 
-            chems1 = save_chems1_Fe(state, PCO2, chems1, j)
-            j = j + 1
-
         df = pd.DataFrame({
             'Fe++': chems1['Fe+2'],
             'Siderite': chems1['Siderite'],
@@ -287,5 +741,10 @@ def phases_PCO2(
         output_phases_PCO2(df, DIV = DIV, beta = beta, nDIV = nDIV, nSiO2 = nSiO2,
                            table_flag = table_flag, plot_flag = plot_flag)
         
-    return
+    output_stats(stats)
+    if stats_flag == True:
+        output_stats_table(stats, {'PCO2': PCO2s}, phases_name(DIV, nSiO2),
+                           table_flag = table_flag, plot_flag = plot_flag)
+
+    return stats
 
@@ -13,11 +13,14 @@
 import numpy as np
 import pandas as pd
 
+from inputs import RENDER_DEFAULTS
 from store import *
+from cache import cache_summary
 
 import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
 from matplotlib import ticker
+from matplotlib.collections import Collection
 
 from matplotlib.cm import get_cmap
 
@@ -27,6 +30,194 @@ col3 = get_cmap('Set3').colors
 colors = col1 + col2 + col3
 
 
+# Render figures interactively or in headless batches
+
+_render = {'batch': False, 'rasterize': False, 'dpi': RENDER_DEFAULTS["dpi"]}
+
+def batch_render(rasterize = RENDER_DEFAULTS["rasterize"], dpi = RENDER_DEFAULTS["dpi"]):
+    '''
+    Switches to the non-interactive Agg backend and closes figures after saving them, with contourf
+    layers rasterized at dpi if rasterize is True
+    '''
+    plt.switch_backend('Agg')
+    _render.update(batch = True, rasterize = rasterize, dpi = dpi)
+
+def render_config():
+    '''
+    Returns (rasterize, dpi) of batch rendering to enable it again in another process, or None
+    '''
+    if _render['batch'] == False:
+        return None
+    return _render['rasterize'], _render['dpi']
+
+def rasterize(artist):
+    '''
+    Rasterizes a contourf or pcolormesh layer in batch rendering, so that the PDF size does not grow with the grid
+    '''
+    if _render['rasterize'] == True:
+        layers = [artist] if isinstance(artist, Collection) else artist.collections # one Collection from matplotlib 3.8
+        for layer in layers: # the axes rasterize everything below zorder 0
+            layer.set_zorder(-1)
+        layers[0].axes.set_rasterization_zorder(0)
+
+def save_figure(path):
+    '''
+    Saves the current figure to path, and closes all figures in batch rendering
+    '''
+    dpi = _render['dpi'] if _render['rasterize'] == True else 'figure'
+    plt.savefig(path, bbox_inches='tight', dpi = dpi)
+    if _render['batch'] == True:
+        plt.close('all')
+
+
+# Report convergence, solver iterations and wall time of a sweep
+
+def output_stats(stats, continuation = False, skipped = 0):
+    '''
+    Prints a summary of the convergence, solver iterations and wall time of the solves of a sweep
+    '''
+    if continuation == True:
+        start = 'warm-started'
+    else:
+        start = 'cold-started'
+    solves = np.nansum(stats['solves'])
+    failed = np.nansum(stats['solves'] * (1 - stats['success']))
+    print('Solver iterations per point (%s): mean %.1f over %d solves in %.2f s'
+          % (start, np.nansum(stats['iterations']) / max(solves, 1), solves, np.nansum(stats['seconds'])))
+    if failed > 0:
+        print('Warning: %d solves did not converge' % failed)
+    retried = [np.sum(stats['fallback'] == n) for n in range(1, 4)]
+    if np.sum(retried) > 0:
+        print('Retried failed solves by last stage (neighbour, maxiters, substep): %d, %d, %d' % tuple(retried))
+    if skipped > 0:
+        print('Skipped %d solves of the full pressure grid' % skipped)
+    cache_summary()
+
+    return
+
+def output_stats_table(stats, coords, name, table_flag = True, plot_flag = True):
+    '''
+    Returns table and heatmap of solver statistics on the grid of coords, a dictionary of the grid
+    values along each axis of stats, with 3D statistics summed over their last axis in the heatmap
+    '''
+    if table_flag == True:
+        index = pd.MultiIndex.from_product(list(coords.values()), names = list(coords.keys()))
+        df = pd.DataFrame({field: np.ravel(stats[field]) for field in stats}, index = index)
+        df.to_csv(name + '_stats.csv')
+
+    if plot_flag == True and len(coords) in (2, 3):
+        (ylabel, ys), (xlabel, xs) = list(coords.items())[:2]
+        fields = {field: stats[field] for field in stats}
+        if len(coords) == 3: # e.g. over the pressures of each CCD column
+            fields = {field: np.nansum(stats[field], axis = -1) for field in ['iterations', 'seconds', 'solves']}
+            fields['success'] = np.fmin.reduce(stats['success'], axis = -1) # NaN only if nothing was solved
+        fig, axs = plt.subplots(1, 2, figsize = (12, 4.5))
+        plt.subplots_adjust(bottom = 0.15, wspace = 0.3)
+        labels = [('iterations', 'Solver iterations per solve'), ('seconds', 'Wall time per solve [s]')]
+        for ax, (field, label) in zip(axs, labels):
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                per_solve = fields[field] / fields['solves']
+            pc = ax.pcolormesh(xs, ys, per_solve, shading = 'auto', cmap = plt.get_cmap('viridis'))
+            rasterize(pc)
+            fig.colorbar(pc, ax = ax, label = label)
+            failed = np.argwhere(fields['success'] < 1)
+            ax.scatter(np.asarray(xs)[failed[:, 1]], np.asarray(ys)[failed[:, 0]], color = 'red', marker = 'x')
+            if xlabel == 'PCO2':
+                ax.set_xscale('log')
+            ax.set_xlabel(xlabel, fontsize = 14)
+            ax.set_ylabel(ylabel, fontsize = 14)
+        save_figure(name + '_stats.pdf')
+
+    return
+
+
+# Output depth maps of several dissolution thresholds of one CCD sweep
+
+def output_CCD_thresholds(PCO2s, Temps, CCDs, thresholds, name, table_flag = True, plot_flag = True):
+    '''
+    Returns table and plots of depths [km] as a function of PCO2 [bar] and Temp [K] at each of thresholds,
+    fractions of the surface carbonate left at that depth
+    '''
+    if table_flag == True:
+        index = pd.MultiIndex.from_product([Temps, PCO2s], names = ['Temp', 'PCO2'])
+        df = pd.DataFrame({str(fraction): np.ravel(CCDs[m]) for m, fraction in enumerate(thresholds)}, index = index)
+        df.to_csv(name + '_thresholds.csv')
+
+    if plot_flag == True:
+        fig, axs = plt.subplots(1, len(thresholds), figsize = (5 * len(thresholds), 4.5), squeeze = False)
+        plt.subplots_adjust(bottom = 0.15, wspace = 0.3)
+        levels = np.array([1e-3, 1e-2, 0.1, 1, 2, 4, 10, 20, 40, 100])
+        for ax, fraction, depths in zip(axs[0], thresholds, CCDs):
+            cf = ax.contourf(PCO2s, Temps, depths, levels = levels, extend = 'both', locator = ticker.LogLocator(),
+                             cmap = plt.get_cmap('viridis'))
+            rasterize(cf)
+            fig.colorbar(cf, ax = ax, label = 'Depth [km]')
+            ax.set_xscale('log')
+            ax.set_xlabel(r'$P_{\rm CO_2}$ [bar]', fontsize = 14)
+            ax.set_ylabel(r'$T$ [K]', fontsize = 14)
+            ax.set_title('%g of surface carbonate left' % fraction, fontsize = 14)
+        save_figure(name + '_thresholds.pdf')
+
+    return
+
+
+# Output maps of pH and carbonate species of one CCD sweep
+
+def output_CCD_maps(PCO2s, Temps, maps, totP, name, table_flag = True, plot_flag = True):
+    '''
+    Returns table and plots of pH and the carbonate species [mol/m3] at totP [bar] as a function of
+    PCO2 [bar] and Temp [K]
+    '''
+    if table_flag == True:
+        index = pd.MultiIndex.from_product([Temps, PCO2s], names = ['Temp', 'PCO2'])
+        df = pd.DataFrame({species: np.ravel(maps[species]) for species in maps}, index = index)
+        df.insert(0, 'totP', totP)
+        df.to_csv(name + '_maps.csv')
+
+    if plot_flag == True:
+        fig, axs = plt.subplots(2, (len(maps) + 1) // 2, figsize = (5 * ((len(maps) + 1) // 2), 9), squeeze = False)
+        plt.subplots_adjust(bottom = 0.1, wspace = 0.35, hspace = 0.35)
+        for ax, species in zip(axs.flat, maps):
+            if species == 'pH':
+                values, label = maps[species], 'Ocean pH'
+            else: # amounts span orders of magnitude, zero amounts are left blank
+                with np.errstate(divide = 'ignore'):
+                    values = np.log10(np.where(maps[species] > 0, maps[species], np.nan))
+                label = r'log$_{10}$ %s [mol m$^{-3}$]' % species
+            cf = ax.contourf(PCO2s, Temps, np.ma.masked_invalid(values), levels = 20, cmap = plt.get_cmap('viridis'))
+            rasterize(cf)
+            fig.colorbar(cf, ax = ax, label = label)
+            ax.set_xscale('log')
+            ax.set_xlabel(r'$P_{\rm CO_2}$ [bar]', fontsize = 14)
+            ax.set_ylabel(r'$T$ [K]', fontsize = 14)
+        for ax in axs.flat[len(maps):]:
+            ax.set_visible(False)
+        fig.suptitle('%g bar (%.2f km)' % (totP, ocean_depth(totP)), fontsize = 14)
+        save_figure(name + '_maps.pdf')
+
+    return
+
+
+# Report wall time of figure jobs
+
+def output_jobs(times, failed, wall, memo = None):
+    '''
+    Prints wall time [s] of each finished job, the failed jobs, the total wall time [s] of a run and the
+    hits and misses of the session memos of its jobs
+    '''
+    print('%-24s %10s' % ('job', 'time [s]'))
+    for name, seconds in sorted(times.items(), key = lambda item: -item[1]):
+        print('%-24s %10.1f' % (name, seconds))
+    for name, error in failed.items():
+        print('%-24s %10s  %s' % (name, 'failed', error))
+    print('%d jobs took %.1f s of job time in %.1f s of wall time' % (len(times), sum(times.values()), wall))
+    if memo is not None and sum(memo) > 0:
+        print('Session memos: %d of %d solves served from memory (%.1f%% hit rate)'
+              % (memo[0], sum(memo), 100 * memo[0] / sum(memo)))
+
+    return
+
+
 # Plot analytical and numerical limits of pH as a function of PCO2
 
 def output_pH_PCO2(PCO2s, chems2, DIV = 'Ca', plot_flag = True, table_flag = True):
@@ -98,7 +289,7 @@ def output_pH_PCO2(PCO2s, chems2, DIV = 'Ca', plot_flag = True, table_flag = Tru
             p11.legend(fontsize=10, bbox_to_anchor=(0.05,0.3), borderaxespad=0, loc='lower left')
 
             p11.set_title(r'Ca', fontsize=16)
-            plt.savefig('fig2a.pdf', bbox_inches='tight')
+            save_figure('fig2a.pdf')
             # plt.savefig('pH_PCO2_Ca.pdf', bbox_inches='tight')
             
     ####################################
@@ -167,7 +358,7 @@ def output_pH_PCO2(PCO2s, chems2, DIV = 'Ca', plot_flag = True, table_flag = Tru
             p11.legend(fontsize=10, bbox_to_anchor=(0.05,0.3), borderaxespad=0, loc='lower left')
 
             p11.set_title(r'Mg', fontsize=16)
-            plt.savefig('fig2b.pdf', bbox_inches='tight')
+            save_figure('fig2b.pdf')
             # plt.savefig('pH_PCO2_Mg.pdf', bbox_inches='tight')
             
     ####################################
@@ -236,7 +427,7 @@ def output_pH_PCO2(PCO2s, chems2, DIV = 'Ca', plot_flag = True, table_flag = Tru
             p11.legend(fontsize=10, bbox_to_anchor=(0.05,0.3), borderaxespad=0, loc='lower left')
 
             p11.set_title(r'Fe', fontsize=16)
-            plt.savefig('fig2c.pdf', bbox_inches='tight')
+            save_figure('fig2c.pdf')
             # plt.savefig('pH_PCO2_Fe.pdf', bbox_inches='tight')
             
     return
@@ -314,7 +505,7 @@ def output_pH_PCO2_an(PCO2s, chems2, chems2_an, chems2_san, DIV = 'Ca', nDIV_fix
             p11.legend(fontsize=10, bbox_to_anchor=(0.05,0.05), borderaxespad=0, loc='lower left')
 
             p11.set_title(r'Ca', fontsize=16)
-            plt.savefig('figA1.pdf', bbox_inches='tight')
+            save_figure('figA1.pdf')
             # plt.savefig('pHan_PCO2_Ca.pdf', bbox_inches='tight')
             
     return
@@ -391,7 +582,7 @@ def output_pH_P(totPs, chems2, DIV = 'Ca', plot_flag = True, table_flag = True):
             p11.legend(fontsize=10, bbox_to_anchor=(0.05,0.3), borderaxespad=0, loc='lower left')
 
             p11.set_title(r'Ca', fontsize=16)
-            plt.savefig('figA2a.pdf', bbox_inches='tight')
+            save_figure('figA2a.pdf')
             # plt.savefig('pH_P_Ca.pdf', bbox_inches='tight')
             
     return
@@ -466,12 +657,33 @@ def output_pH_T(Temps, chems2, DIV = 'Ca', plot_flag = True, table_flag = True):
             p11.legend(fontsize=10, bbox_to_anchor=(0.05,0.3), borderaxespad=0, loc='lower left')
 
             p11.set_title(r'Ca', fontsize=16)
-            plt.savefig('figA2b.pdf', bbox_inches='tight')
+            save_figure('figA2b.pdf')
             # plt.savefig('pH_T_Ca.pdf', bbox_inches='tight')
             
     return
 
 
+# Name CCD tables and figures
+
+def CCD_name(DIV, nSiO2):
+    '''
+    Returns file name without extension of the CCD table and figure for DIV and nSiO2
+    '''
+    letter = {'Ca': 'a', 'Mg': 'b', 'Fe': 'c'}[DIV]
+    if nSiO2 == 0:
+        return 'figA3' + letter
+    return 'fig3' + letter
+
+def phases_name(DIV, nSiO2):
+    '''
+    Returns file name without extension of the stable phases table and figure for DIV and nSiO2
+    '''
+    letter = {'Ca': 'a', 'Mg': 'b', 'Fe': 'c'}[DIV]
+    if nSiO2 == 0:
+        return 'figA4' + letter
+    return 'fig4' + letter
+
+
 # Output Ca-CCD as a function of PCO2 and T
 
 def output_CaCCD_PCO2_T(PCO2s, Temps, CCDs, beta = 0.3, nSiO2 = 1, nDIV = 1, 
@@ -517,6 +729,8 @@ def plot_CaCCD_PCO2_T(PCO2s, Temps, CCDs, beta = 0.3, nSiO2 = 1, nDIV = 1):
         cf = ax.contourf(PCO2s, Temps, CCDs, levels = levels, extend = 'both', locator=ticker.LogLocator(), 
                           cmap = plt.get_cmap('viridis'))
 
+        rasterize(cf)
+
         fig.colorbar(cf, ax=ax, label='CCD [km]')
 
         ax.scatter(0.3e-3, 288, color='gray', marker='o')
@@ -560,6 +774,8 @@ def plot_CaCCD_PCO2_T(PCO2s, Temps, CCDs, beta = 0.3, nSiO2 = 1, nDIV = 1):
         cf = ax.contourf(PCO2s, Temps, CCDs, levels = levels, extend = 'both', locator=ticker.LogLocator(), 
                           cmap = plt.get_cmap('viridis')) 
 
+        rasterize(cf)
+
         PCO2sA, TempsA = np.meshgrid(PCO2s, Temps)
 
         nCarb = nDIV * weath_scaling(PCO2sA, TempsA, beta=beta)
@@ -604,9 +820,9 @@ def plot_CaCCD_PCO2_T(PCO2s, Temps, CCDs, beta = 0.3, nSiO2 = 1, nDIV = 1):
 
         ax.set_title(r'Ca-CCD', fontsize=18)
         if nSiO2 == 0:
-            plt.savefig('figA3a.pdf', bbox_inches='tight')
+            save_figure('figA3a.pdf')
         elif nSiO2 == 1:
-            plt.savefig('fig3a.pdf', bbox_inches='tight')
+            save_figure('fig3a.pdf')
         # plt.savefig('CCD_Ca_beta30_nSiO2%s.pdf'%(int(nSiO2)), bbox_inches='tight')
         
     return
@@ -657,6 +873,8 @@ def plot_MgCCD_PCO2_T(PCO2s, Temps, CCDs, beta = 0.3, nSiO2 = 1, nDIV = 1):
         cf = ax.contourf(PCO2s, Temps, CCDs, levels = levels, extend = 'both', locator=ticker.LogLocator(), 
                           cmap = plt.get_cmap('viridis'))
 
+        rasterize(cf)
+
         fig.colorbar(cf, ax=ax, label='CCD [km]')
 
         ax.scatter(0.3e-3, 288, color='gray', marker='o')
@@ -700,6 +918,8 @@ def plot_MgCCD_PCO2_T(PCO2s, Temps, CCDs, beta = 0.3, nSiO2 = 1, nDIV = 1):
         cf = ax.contourf(PCO2s, Temps, CCDs, levels = levels, extend = 'both', locator=ticker.LogLocator(), 
                           cmap = plt.get_cmap('viridis')) 
 
+        rasterize(cf)
+
         PCO2sA, TempsA = np.meshgrid(PCO2s, Temps)
 
         nCarb = nDIV * weath_scaling(PCO2sA, TempsA, beta=beta)
@@ -744,9 +964,9 @@ def plot_MgCCD_PCO2_T(PCO2s, Temps, CCDs, beta = 0.3, nSiO2 = 1, nDIV = 1):
 
         ax.set_title(r'Mg-CCD', fontsize=18)
         if nSiO2 == 0:
-            plt.savefig('figA3b.pdf', bbox_inches='tight')
+            save_figure('figA3b.pdf')
         elif nSiO2 == 1:
-            plt.savefig('fig3b.pdf', bbox_inches='tight')
+            save_figure('fig3b.pdf')
         # plt.savefig('CCD_Mg_beta30_nSiO2%s.pdf'%(int(nSiO2)), bbox_inches='tight')
         
     return
@@ -797,6 +1017,8 @@ def plot_FeCCD_PCO2_T(PCO2s, Temps, CCDs, beta = 0.3, nSiO2 = 1, nDIV = 1):
         cf = ax.contourf(PCO2s, Temps, CCDs, levels = levels, extend = 'both', locator=ticker.LogLocator(), 
                           cmap = plt.get_cmap('viridis'))
 
+        rasterize(cf)
+
         fig.colorbar(cf, ax=ax, label='CCD [km]')
 
         ax.scatter(0.3e-3, 288, color='gray', marker='o')
@@ -832,6 +1054,8 @@ def plot_FeCCD_PCO2_T(PCO2s, Temps, CCDs, beta = 0.3, nSiO2 = 1, nDIV = 1):
         cf = ax.contourf(PCO2s, Temps, CCDs, levels = levels, extend = 'both', locator=ticker.LogLocator(), 
                           cmap = plt.get_cmap('viridis')) 
 
+        rasterize(cf)
+
         PCO2sA, TempsA = np.meshgrid(PCO2s, Temps)
 
         nCarb = nDIV * weath_scaling(PCO2sA, TempsA, beta=beta)
@@ -868,9 +1092,9 @@ def plot_FeCCD_PCO2_T(PCO2s, Temps, CCDs, beta = 0.3, nSiO2 = 1, nDIV = 1):
 
         ax.set_title(r'Fe-CCD', fontsize=18)
         if nSiO2 == 0:
-            plt.savefig('figA3c.pdf', bbox_inches='tight')
+            save_figure('figA3c.pdf')
         elif nSiO2 == 1:
-            plt.savefig('fig3c.pdf', bbox_inches='tight')
+            save_figure('fig3c.pdf')
         # plt.savefig('CCD_Fe_beta30_n%s_nSiO2%s.pdf'%(int(nDIV), int(nSiO2)), bbox_inches='tight')
         
     return
@@ -957,9 +1181,9 @@ def plot_phases_PCO2 (df, DIV = 'Ca', beta = 0.3, nDIV = 1, nSiO2 = 1):
         p11.set_title(r'Ca Partitioning', fontsize=16)
         
         if nSiO2 == 0:
-            plt.savefig('figA4a.pdf',bbox_inches='tight')
+            save_figure('figA4a.pdf')
         elif nSiO2 == 1:
-            plt.savefig('fig4a.pdf',bbox_inches='tight')
+            save_figure('fig4a.pdf')
         #plt.savefig('phases_PCO2_Ca_beta%s_nSiO2%s.pdf'%(int(beta*100), int(nSiO2)),bbox_inches='tight')
         
     elif DIV == 'Mg':
@@ -992,9 +1216,9 @@ def plot_phases_PCO2 (df, DIV = 'Ca', beta = 0.3, nDIV = 1, nSiO2 = 1):
         p11.set_title(r'Mg Partitioning', fontsize=16)
         
         if nSiO2 == 0:
-            plt.savefig('figA4b.pdf',bbox_inches='tight')
+            save_figure('figA4b.pdf')
         elif nSiO2 == 1:
-            plt.savefig('fig4b.pdf',bbox_inches='tight')
+            save_figure('fig4b.pdf')
         # plt.savefig('phases_PCO2_Mg_beta%s_nSiO2%s.pdf'%(int(beta*100), int(nSiO2)),bbox_inches='tight')    
         
     elif DIV == 'Fe':
@@ -1027,9 +1251,9 @@ def plot_phases_PCO2 (df, DIV = 'Ca', beta = 0.3, nDIV = 1, nSiO2 = 1):
         p11.set_title(r'Fe Partitioning', fontsize=16)
         
         if nSiO2 == 0:
-            plt.savefig('figA4c.pdf',bbox_inches='tight')
+            save_figure('figA4c.pdf')
         elif nSiO2 == 1:
-            plt.savefig('fig4c.pdf',bbox_inches='tight')
+            save_figure('fig4c.pdf')
         #plt.savefig('phases_PCO2_Fe_beta%s_nSiO2%s.pdf'%(int(beta*100), int(nSiO2)),bbox_inches='tight')
         
     return
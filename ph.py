@@ -10,6 +10,25 @@ from solve import *
 from output import *
 
 
+def pH_an(DIV, PCO2, Temp = PH_DEFAULTS["Temp"], totP = PH_DEFAULTS["totP"], nDIV = PH_DEFAULTS["nDIV"]):
+    '''
+    Returns analytical lower and upper limits of ocean pH for Ca, Mg or Fe carbonate systems,
+    broadcast over arrays of PCO2 [bar], Temp [K], totP [bar] and nDIV without numerical solves
+    '''
+    if DIV != 'Ca' and DIV != 'Mg' and DIV != 'Fe':
+        print('Error: Enter DIV = "Ca" or "Mg" or "Fe"')
+        return
+
+    logK3, logK9, logK16 = logK_an(DIV, Temp, totP) # shape of Temp and totP broadcast together
+
+    pH_low = ocean_pH_low(PCO2, logK3)
+    pH_upp = ocean_pH_upp(PCO2, nDIV, logK9, logK16)
+
+    shape = np.broadcast_shapes(np.shape(PCO2), np.shape(Temp), np.shape(totP), np.shape(nDIV))
+
+    return np.broadcast_to(pH_low, shape), np.broadcast_to(pH_upp, shape)
+
+
 class PH:
     def __init__(
         self,
@@ -23,6 +42,9 @@ class PH:
         table_flag = PH_DEFAULTS["table_flag"],
         analytical_flag = PH_DEFAULTS["analytical_flag"],
         comparison = PH_DEFAULTS["comparison"],
+        continuation = PH_DEFAULTS["continuation"],
+        stats_flag = PH_DEFAULTS["stats_flag"],
+        retry_flag = PH_DEFAULTS["retry_flag"],
     ):
                  
         self.DIV = DIV
@@ -37,6 +59,9 @@ class PH:
         self.table_flag = table_flag
         self.analytical_flag = analytical_flag
         self.comparison = comparison
+        self.continuation = continuation
+        self.stats_flag = stats_flag
+        self.retry_flag = retry_flag
 
         if self.comparison == 'PCO2':
             if self.analytical_flag == True:
@@ -51,14 +76,15 @@ class PH:
             self.pH_T()
 
 
-    def _run(self, PCO2s, setup_fn, solve_fn, save_fn):
+    def _stream(self, PCO2s, setup_fn, solve_fn):
             numQ = 3
             betas = np.array([-1, 0, 0.3])
-            chems2 = chem_dict2(numQ, self.totnum)
             system, specs, solver = setup_fn()
             for i in range(numQ):
                 j = 0
                 beta = betas[i]
+                state0 = None
+                good = self._good()
                 while j < self.totnum:
                         PCO2 = PCO2s[j]
                         if beta == -1:
@@ -70,11 +96,50 @@ class PH:
                         else:
                             addDIVtot = self.nDIV * weath_scaling(PCO2, self.Temp, beta=beta) / numden
                             addSiO2   = self.nSiO2 * addDIVtot
-                        state = solve_fn(system, specs, solver, addDIVtot, addSiO2, PCO2, self.Temp, self.totP)
-                        chems2 = save_fn(state, PCO2, chems2, i, j)
+                        state, result = solve_fn(system, specs, solver, addDIVtot, addSiO2, PCO2, self.Temp, self.totP,
+                                                 state0 = state0, result_flag = True, good = good)
+                        state0 = self._state0(state, result, state0)
+                        yield Point(self.DIV, (i, j), PCO2, self.Temp, self.totP, species_record(state, PCO2, self.DIV),
+                                    stats_record(result))
                         j = j + 1
+
+    def _run(self, PCO2s, setup_fn, solve_fn):
+            numQ = 3
+            betas = np.array([-1, 0, 0.3])
+            chems2 = chem_dict2(numQ, self.totnum, DIV = self.DIV)
+            self.stats = stats_dict((numQ, self.totnum))
+            for point in self._stream(PCO2s, setup_fn, solve_fn):
+                chems2 = save_point(point, chems2, self.stats)
+            self._output_stats({'beta': betas, 'PCO2': PCO2s}, 'pH_PCO2_' + self.DIV)
             return chems2
 
+    def _good(self):
+        '''
+        Returns empty record of the last converged point of a sweep if failed solves are retried, else None
+        '''
+        if self.retry_flag == True:
+            return {}
+        return None
+
+    def _output_stats(self, coords, name):
+        '''
+        Prints solver statistics of the last sweep in self.stats and writes them if stats_flag is on
+        '''
+        output_stats(self.stats, continuation = self.continuation)
+        if self.stats_flag == True:
+            output_stats_table(self.stats, coords, name, table_flag = self.table_flag, plot_flag = self.plot_flag)
+
+    def _state0(self, state, result, state0):
+        '''
+        Returns the initial state of the next grid point if continuation is on: state if its solve converged,
+        else the last converged state state0, and None otherwise
+        '''
+        if self.continuation == True and result.succeeded():
+            return state
+        if self.continuation == True:
+            return state0
+        return None
+
 
     def pH_PCO2(self):
         '''
@@ -83,11 +148,11 @@ class PH:
         PCO2s = GRID_DEFAULTS["pco2s"](self.totnum) # bar
 
         if self.DIV == 'Ca':
-            chems2 = self._run(PCO2s, setup_Ca, solve_Ca, save_chems2_Ca)
+            chems2 = self._run(PCO2s, setup_Ca, solve_Ca)
         elif self.DIV == 'Mg':
-            chems2 = self._run(PCO2s, setup_Mg, solve_Mg, save_chems2_Mg)
+            chems2 = self._run(PCO2s, setup_Mg, solve_Mg)
         elif self.DIV == 'Fe':
-            chems2 = self._run(PCO2s, setup_Fe, solve_Fe, save_chems2_Fe)
+            chems2 = self._run(PCO2s, setup_Fe, solve_Fe)
         else:
             return
 
@@ -95,6 +160,20 @@ class PH:
 
         return
 
+    def stream_pH_PCO2(self):
+        '''
+        Yields Point of each solved PCO2 [bar] of pH_PCO2, with grid indices (i, j) into the weathering
+        cases (no cations, fixed cations and weathering) and PCO2s
+        '''
+        PCO2s = GRID_DEFAULTS["pco2s"](self.totnum) # bar
+
+        if self.DIV == 'Ca':
+            yield from self._stream(PCO2s, setup_Ca, solve_Ca)
+        elif self.DIV == 'Mg':
+            yield from self._stream(PCO2s, setup_Mg, solve_Mg)
+        elif self.DIV == 'Fe':
+            yield from self._stream(PCO2s, setup_Fe, solve_Fe)
+
     def pH_PCO2_an(self, nDIV_fixed = 1):
         '''
         Returns analytical/numerical solutions of ocean pH as a function of PCO2 [bar]
@@ -108,9 +187,10 @@ class PH:
 
             numQ = 2
             addDIVtots = numden*np.linspace(0, 1e-2, num=numQ) # in units of 1000 * mol/dm3 = 1 mol/m3
-            chems2 = chem_dict2(numQ,self.totnum)
-            chems2_san = chem_dict2(numQ,self.totnum)
-            chems2_an = chem_dict2(numQ,self.totnum)
+            chems2 = chem_dict2(numQ, self.totnum, DIV = self.DIV)
+            chems2_san = chem_dict2(numQ, self.totnum, DIV = self.DIV)
+            chems2_an = chem_dict2(numQ, self.totnum, DIV = self.DIV)
+            self.stats = stats_dict((numQ, self.totnum))
 
             system, specs, solver = setup_Ca()
             
@@ -120,15 +200,22 @@ class PH:
                 j = 0
                 addDIVtot = addDIVtots[i] / numden
                 addSiO2   = 0
+                state0 = None
+                good = self._good()
 
                 while j < self.totnum:
                     PCO2 = PCO2s[j]
-                    state = solve_Ca(system, specs, solver, addDIVtot, addSiO2, PCO2, self.Temp, self.totP)
+                    state, result = solve_Ca(system, specs, solver, addDIVtot, addSiO2, PCO2, self.Temp, self.totP,
+                                             state0 = state0, result_flag = True, good = good)
+                    state0 = self._state0(state, result, state0)
                     chems2 = save_chems2_Ca(state, PCO2, chems2, i, j)
+                    self.stats = save_stats(result, self.stats, (i, j))
                     chems2_an, chems2_san = save_chems2_an_Ca(PCO2, logK3, logK9, logK16, nDIV_fixed,
                                                               chems2['Ca+2'][i][j], chems2_an, chems2_san, i, j)
                     j = j + 1
 
+            self._output_stats({'addDIVtot': addDIVtots, 'PCO2': PCO2s}, 'pHan_PCO2_Ca')
+
             output_pH_PCO2_an(PCO2s, chems2, chems2_an, chems2_san, DIV = self.DIV, nDIV_fixed = nDIV_fixed,
                               plot_flag = self.plot_flag, table_flag = self.table_flag)
         
@@ -149,13 +236,16 @@ class PH:
 
             numQ = 3
             betas = np.array([-1, 0, 0.3]) 
-            chems2 = chem_dict2(numQ, self.totnum)
+            chems2 = chem_dict2(numQ, self.totnum, DIV = self.DIV)
+            self.stats = stats_dict((numQ, self.totnum))
 
             system, specs, solver = setup_Ca()
 
             for i in range(numQ):
                 j = 0
                 beta = betas[i]
+                state0 = None
+                good = self._good()
                 while j < self.totnum:
 
                     totP = totPs[j]
@@ -169,9 +259,14 @@ class PH:
                         addDIVtot = self.nDIV * weath_scaling(PCO2, self.Temp, beta=beta) / numden
                         addSiO2   = self.nSiO2 * addDIVtot
 
-                    state = solve_Ca(system, specs, solver, addDIVtot, addSiO2, PCO2, self.Temp, totP)
+                    state, result = solve_Ca(system, specs, solver, addDIVtot, addSiO2, PCO2, self.Temp, totP,
+                                             state0 = state0, result_flag = True, good = good)
+                    state0 = self._state0(state, result, state0)
                     chems2 = save_chems2_Ca(state, PCO2, chems2, i, j)
+                    self.stats = save_stats(result, self.stats, (i, j))
                     j = j + 1
+
+            self._output_stats({'beta': betas, 'totP': totPs}, 'pH_P_Ca')
                     
         output_pH_P(totPs, chems2, DIV = self.DIV, plot_flag = self.plot_flag, table_flag = self.table_flag)
 
@@ -193,7 +288,8 @@ class PH:
             numQ = 3
             betas = np.array([-1, 0, 0.3]) 
 
-            chems2 = chem_dict2(numQ, self.totnum)
+            chems2 = chem_dict2(numQ, self.totnum, DIV = self.DIV)
+            self.stats = stats_dict((numQ, self.totnum))
 
             system, specs, solver = setup_Ca()
 
@@ -201,6 +297,8 @@ class PH:
                 j = 0
 
                 beta = betas[i]
+                state0 = None
+                good = self._good()
                 while j < self.totnum:
 
                     Temp = Temps[j]
@@ -214,10 +312,15 @@ class PH:
                         addDIVtot = self.nDIV * weath_scaling(PCO2, Temp, beta=beta) / numden
                         addSiO2   = self.nSiO2 * addDIVtot
 
-                    state = solve_Ca(system, specs, solver, addDIVtot, addSiO2, PCO2, Temp, self.totP)
+                    state, result = solve_Ca(system, specs, solver, addDIVtot, addSiO2, PCO2, Temp, self.totP,
+                                             state0 = state0, result_flag = True, good = good)
+                    state0 = self._state0(state, result, state0)
                     chems2 = save_chems2_Ca(state, PCO2, chems2, i, j)
+                    self.stats = save_stats(result, self.stats, (i, j))
                     j = j + 1
 
+            self._output_stats({'beta': betas, 'Temp': Temps}, 'pH_T_Ca')
+
             output_pH_T(Temps, chems2, DIV = self.DIV, plot_flag = self.plot_flag, table_flag = self.table_flag)
         
         return
@@ -9,79 +9,112 @@
 # ### plots_paper.py # contains functions to make plots available in the published paper
 
 # Import ocra
+import argparse
+
 from ocra import *
 from ph import PH
+from inputs import RUNNER_DEFAULTS
+from runner import Job, run_jobs
+
+
+def pH_figure(method, **kwargs):
+    '''
+    Makes an ocean pH figure with the PH method of the given name
+    '''
+    getattr(PH(comparison = None, **kwargs), method)()
+
+
+# Jobs are listed longest first, so that the CCD maps start before the quick figures
+
+JOBS = [
+
+    ## CCD figures
+
+    ### nSiO2 = 1 includes silica and 0 excludes silica
+    ### numQ1 is the number of steps in x-axis
+    ### numQ2 is the number of steps in y-axis
+    ### totnum is the number of steps in z-axis
+
+    # Plot Ca-CCD as a function of PCO2 and T with no silicates
+    Job('figA3a', CaCCD_PCO2_T, dict(nSiO2 = 0, totnum = 20, numQ1 = 100, numQ2 = 100)),
+
+    # Plot Ca-CCD as a function of PCO2 and T with silicates
+    Job('fig3a', CaCCD_PCO2_T, dict(totnum = 20, numQ1 = 100, numQ2 = 100)),
 
+    # Plot Mg-CCD as a function of PCO2 and T with no silicates
+    Job('figA3b', MgCCD_PCO2_T, dict(nSiO2 = 0, totnum = 20, numQ1 = 100, numQ2 = 100)),
 
-## Ocean pH figures
+    # Plot Mg-CCD as a function of PCO2 and T with silicates
+    Job('fig3b', MgCCD_PCO2_T, dict(totnum = 20, numQ1 = 100, numQ2 = 100)),
 
-### DIV decides the carbonate system: Ca, Mg or Fe
+    # Plot Fe-CCD as a function of PCO2 and T with no silicates
+    Job('figA3c', FeCCD_PCO2_T, dict(nSiO2 = 0, totnum = 20, numQ1 = 100, numQ2 = 100)),
 
-# Plot ocean pH as a function of PCO2 for the Ca-system
-PH(DIV='Ca').pH_PCO2()
+    # Plot Fe-CCD as a function of PCO2 and T with silicates
+    Job('fig3c', FeCCD_PCO2_T, dict(totnum = 20, numQ1 = 100, numQ2 = 100)),
 
-# Plot ocean pH as a function of PCO2 for the Mg-system
-PH(DIV='Mg').pH_PCO2()
 
-# Plot ocean pH as a function of PCO2 for the Fe-system
-PH(DIV='Fe').pH_PCO2()
+    ## Ocean pH figures
 
-# Plot numerical and analytical solutions of ocean pH
-PH().pH_PCO2_an()
+    ### DIV decides the carbonate system: Ca, Mg or Fe
 
-# Plot ocean pH as a function of P
-PH().pH_P()
+    # Plot ocean pH as a function of PCO2 for the Ca-system
+    Job('fig2a', pH_figure, dict(method = 'pH_PCO2', DIV = 'Ca')),
 
-# Plot ocean pH as a function of T
-PH().pH_T()
+    # Plot ocean pH as a function of PCO2 for the Mg-system
+    Job('fig2b', pH_figure, dict(method = 'pH_PCO2', DIV = 'Mg')),
 
+    # Plot ocean pH as a function of PCO2 for the Fe-system
+    Job('fig2c', pH_figure, dict(method = 'pH_PCO2', DIV = 'Fe')),
 
-## CCD figures
+    # Plot numerical and analytical solutions of ocean pH
+    Job('figA1', pH_figure, dict(method = 'pH_PCO2_an')),
 
-### nSiO2 = 1 includes silica and 0 excludes silica
-### numQ1 is the number of steps in x-axis
-### numQ2 is the number of steps in y-axis
-### totnum is the number of steps in z-axis
+    # Plot ocean pH as a function of P
+    Job('figA2a', pH_figure, dict(method = 'pH_P')),
 
-# Plot Ca-CCD as a function of PCO2 and T with no silicates
-CaCCD_PCO2_T(nSiO2 = 0, totnum = 20, numQ1 = 100, numQ2 = 100)
+    # Plot ocean pH as a function of T
+    Job('figA2b', pH_figure, dict(method = 'pH_T')),
 
-# Plot Ca-CCD as a function of PCO2 and T with silicates
-CaCCD_PCO2_T(totnum = 20, numQ1 = 100, numQ2 = 100)
 
-# Plot Mg-CCD as a function of PCO2 and T with no silicates
-MgCCD_PCO2_T(nSiO2 = 0, totnum = 20, numQ1 = 100, numQ2 = 100)
+    ## Partitioning figures
 
-# Plot Mg-CCD as a function of PCO2 and T with silicates
-MgCCD_PCO2_T(totnum = 20, numQ1 = 100, numQ2 = 100)
+    ### DIV decides the carbonate system: Ca, Mg or Fe
+    ### nSiO2 = 1 includes silica and 0 excludes silica
+    ### Temp is temperature in kelvin
 
-# Plot Fe-CCD as a function of PCO2 and T with no silicates
-FeCCD_PCO2_T(nSiO2 = 0, totnum = 20, numQ1 = 100, numQ2 = 100)
+    # Plot stable phases as a function of PCO2 for the Ca-system with no silicates
+    Job('figA4a', phases_PCO2, dict(DIV = 'Ca', nSiO2 = 0, Temp = 310)),
 
-# Plot Fe-CCD as a function of PCO2 and T with silicates
-FeCCD_PCO2_T(totnum = 20, numQ1 = 100, numQ2 = 100)
+    # Plot stable phases as a function of PCO2 for the Ca-system with silicates
+    Job('fig4a', phases_PCO2, dict(DIV = 'Ca', nSiO2 = 1, Temp = 310)),
 
+    # Plot stable phases as a function of PCO2 for the Mg-system with no silicates
+    Job('figA4b', phases_PCO2, dict(DIV = 'Mg', nSiO2 = 0, Temp = 310)),
 
-## Partitioning figures
+    # Plot stable phases as a function of PCO2 for the Mg-system with silicates
+    Job('fig4b', phases_PCO2, dict(DIV = 'Mg', nSiO2 = 1, Temp = 310)),
 
-### DIV decides the carbonate system: Ca, Mg or Fe
-### nSiO2 = 1 includes silica and 0 excludes silica
-### Temp is temperature in kelvin
+    # Plot stable phases as a function of PCO2 for the Fe-system with no silicates
+    Job('figA4c', phases_PCO2, dict(DIV = 'Fe', nSiO2 = 0, Temp = 310)),
 
-# Plot stable phases as a function of PCO2 for the Ca-system with no silicates
-phases_PCO2(DIV='Ca', nSiO2 = 0, Temp = 310)
+    # Plot stable phases as a function of PCO2 for the Fe-system with silicates
+    Job('fig4c', phases_PCO2, dict(DIV = 'Fe', nSiO2 = 1, Temp = 310)),
+]
 
-# Plot stable phases as a function of PCO2 for the Ca-system with silicates
-phases_PCO2(DIV='Ca', nSiO2 = 1, Temp = 310)
 
-# Plot stable phases as a function of PCO2 for the Mg-system with no silicates
-phases_PCO2(DIV='Mg', nSiO2 = 0, Temp = 310)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Make the figures of the published paper')
+    parser.add_argument('--workers', type=int, default=RUNNER_DEFAULTS["workers"], help='figures made at the same time')
+    parser.add_argument('--only', nargs='+', help='names of the figures to make')
+    parser.add_argument('--rasterize', action='store_true', help='rasterize the contourf layers of the CCD maps')
+    args = parser.parse_args()
 
-# Plot stable phases as a function of PCO2 for the Mg-system with silicates
-phases_PCO2(DIV='Mg', nSiO2 = 1, Temp = 310)
+    # Render without a display and close each figure once it is saved
+    batch_render(rasterize = args.rasterize)
 
-# Plot stable phases as a function of PCO2 for the Fe-system with no silicates
-phases_PCO2(DIV='Fe', nSiO2 = 0, Temp = 310)
+    # Cache solved points in ocra_cache.sqlite, so that a second run skips unchanged solves
+    enable_cache()
 
-# Plot stable phases as a function of PCO2 for the Fe-system with silicates
-phases_PCO2(DIV='Fe', nSiO2 = 1, Temp = 310)
+    jobs = [job for job in JOBS if args.only is None or job.name in args.only]
+    run_jobs(jobs, workers = args.workers)
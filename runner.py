@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # OCRA: Ocean Chemistry with Reacktoro And beyond
+# ### This Python code implements Reaktoro software to calculate ocean chemistry
+#
+# ## Reference: Hakim et al. (2023) ApJL
+#
+# ### runner.py # contains a task-graph runner to make figures in parallel
+
+# Import libraries
+
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from inputs import RUNNER_DEFAULTS
+from cache import enable_cache, cache_config, memo_counts
+from output import output_jobs, batch_render, render_config
+
+
+class Job:
+    '''
+    Figure job that calls fn(**kwargs) once the jobs named in deps are done
+    '''
+    def __init__(self, name, fn, kwargs = None, deps = ()):
+        self.name = name
+        self.fn = fn
+        self.kwargs = {} if kwargs is None else kwargs
+        self.deps = tuple(deps)
+
+def _init_runner(cache = None, render = None):
+    '''
+    Opens the solve cache and batch rendering of the parent process in a runner process
+    '''
+    if cache is not None:
+        enable_cache(*cache)
+    if render is not None:
+        batch_render(*render)
+
+def _run_job(fn, kwargs):
+    '''
+    Returns wall time [s] of fn(**kwargs), which computes and writes one figure, and the hits and misses of
+    the session memo of this process during the job
+    '''
+    hits, misses = memo_counts()
+    start = time.perf_counter()
+    fn(**kwargs)
+    seconds = time.perf_counter() - start
+    hits1, misses1 = memo_counts()
+    return seconds, hits1 - hits, misses1 - misses
+
+def run_jobs(jobs, workers = RUNNER_DEFAULTS["workers"]):
+    '''
+    Returns wall times [s] of the jobs, each run on one of up to workers processes as soon as the jobs
+    it depends on are done, and prints a timing summary
+    '''
+    names = [job.name for job in jobs]
+    if len(set(names)) != len(names):
+        print('Error: Job names must be unique')
+        return
+    for job in jobs:
+        for dep in job.deps:
+            if dep not in names:
+                print('Error: Job %s depends on unknown job %s' % (job.name, dep))
+                return
+
+    start = time.perf_counter()
+    times = {}
+    memo = [0, 0] # hits and misses of the session memos of all jobs
+    failed = {}
+    pending = list(jobs)
+
+    def ready():
+        for job in list(pending):
+            if any(dep in failed for dep in job.deps):
+                failed[job.name] = 'skipped after a failed dependency'
+                pending.remove(job)
+            elif all(dep in times for dep in job.deps):
+                pending.remove(job)
+                yield job
+
+    def finish(job, result):
+        try:
+            times[job.name], hits, misses = result()
+            memo[0], memo[1] = memo[0] + hits, memo[1] + misses
+            print('Finished %s in %.1f s' % (job.name, times[job.name]))
+        except Exception as error:
+            failed[job.name] = repr(error)
+            print('Failed %s: %r' % (job.name, error))
+
+    if workers <= 1: # in this process, in the order of the jobs
+        progress = True
+        while progress:
+            progress = False
+            for job in list(ready()):
+                finish(job, lambda: _run_job(job.fn, job.kwargs))
+                progress = True
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_runner,
+                                   initargs=(cache_config(), render_config()))
+        running = {}
+        try:
+            while True:
+                for job in ready():
+                    running[pool.submit(_run_job, job.fn, job.kwargs)] = job
+                if len(running) == 0:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(running.pop(future), future.result)
+        finally:
+            pool.shutdown(cancel_futures=True)
+
+    for job in pending: # dependencies that never finished, e.g. cycles
+        failed[job.name] = 'unresolved dependencies'
+
+    output_jobs(times, failed, time.perf_counter() - start, memo = memo)
+
+    return times
@@ -10,46 +10,72 @@
 
 # Import libraries
 
+import os
+import time
+import weakref
+
+import reaktoro
 from reaktoro import *
+from scipy.interpolate import RegularGridInterpolator
+
+from inputs import GRID_DEFAULTS, LOGK_DEFAULTS, RETRY_DEFAULTS
 from store import *
+from cache import *
 
 # Setup Reaktoro to solve ocean chemistry
 
-def setup_an_Ca(Temp, totP):
-    '''
-    Returns chemical analytical setup with system, specs, solver for Ca
-    '''
-    db = SupcrtDatabase('supcrtbl')
+AQUEOUS = ['H2O(aq)','CO2(aq)', 'HCO3-', 'CO3-2', 'H+', 'OH-', 'SiO2(aq)'] # plus the divalent cation
+GASES = ['CO2(g)', 'N2(g)']
+MINERALS = {
+    'Ca': ['Calcite', 'Wollastonite', 'Quartz'],
+    'Mg': ['Magnesite', 'Clino-Enstatite', 'Quartz'],
+    'Fe': ['Siderite', 'Fayalite', 'Quartz'],
+}
 
-    rxn9 = db.reaction('Ca+2 + CO3-2 = Calcite')
-    logK9 = rxn9.props(Temp, 'K', totP, 'bar').lgK[0]
+_setups = {} # (system, specs, solver) keyed by cation and phase lists, plus the database under 'db'
 
-    rxn15 = db.reaction('CO2(g) + H2O(aq) = 2*H+ + CO3-2')
-    logK16 = rxn15.props(Temp, 'K', totP, 'bar').lgK[0]
+def clear_setup_cache():
+    '''
+    Invalidates the cached database and chemical setups, so that they are rebuilt on the next call,
+    and the species names, species indices and solver options kept for them
+    '''
+    _setups.clear()
+    _system_names.clear()
+    _solver_options.clear()
+    clear_species_index()
 
-    rxn3= db.reaction('CO2(g) + H2O(aq) = H+ + HCO3-')
-    logK3 = rxn3.props(Temp, 'K', totP, 'bar').lgK[0]
-    
-    return logK3, logK9, logK16
+def _database():
+    '''
+    Returns the SUPCRTBL database, parsed once per process
+    '''
+    if 'db' not in _setups:
+        _setups['db'] = SupcrtDatabase('supcrtbl')
+    return _setups['db']
 
-def setup_Ca():
+def _setup(DIV, minerals = None, cache_flag = True):
     '''
-    Returns chemical setup with system, specs, solver for Ca
+    Returns chemical setup with system, specs, solver for the divalent cation DIV
     '''
-    db = SupcrtDatabase('supcrtbl')
+    if minerals is None:
+        minerals = MINERALS[DIV]
+    species = AQUEOUS[:6] + [DIV+'+2'] + AQUEOUS[6:]
+
+    key = (DIV, tuple(species), tuple(GASES), tuple(minerals))
+    if cache_flag == True and key in _setups:
+        return _setups[key]
 
-    solution = AqueousPhase(['H2O(aq)','CO2(aq)', 'HCO3-', 'CO3-2', 'H+', 'OH-', 'Ca+2', 'SiO2(aq)'])
+    db = _database()
+
+    solution = AqueousPhase(species)
     solution.setActivityModel(chain(
         ActivityModelHKF(),
         ActivityModelDrummond('CO2(aq)'),
     ))
 
-    gases = GaseousPhase(['CO2(g)', 'N2(g)'])
+    gases = GaseousPhase(GASES)
     gases.setActivityModel(ActivityModelPengRobinson())
 
-    minerals = MineralPhases(['Calcite', 'Wollastonite', 'Quartz'])
-
-    system = ChemicalSystem(db, solution, gases, minerals)
+    system = ChemicalSystem(db, solution, gases, MineralPhases(minerals))
 
     specs = EquilibriumSpecs(system)
     specs.temperature()
@@ -57,130 +83,331 @@ def setup_Ca():
     specs.fugacity('CO2')
 
     solver = EquilibriumSolver(specs)
-    
+
+    if cache_flag == True:
+        _setups[key] = system, specs, solver
+
     return system, specs, solver
 
-def setup_Mg():
+LOGK_REACTIONS = {
+    'logK3': 'CO2(g) + H2O(aq) = H+ + HCO3-',
+    'logK16': 'CO2(g) + H2O(aq) = 2*H+ + CO3-2',
+    'logK9_Ca': 'Ca+2 + CO3-2 = Calcite',
+    'logK9_Mg': 'Mg+2 + CO3-2 = Magnesite',
+    'logK9_Fe': 'Fe+2 + CO3-2 = Siderite',
+}
+
+def _setup_an(DIV, Temp, totP):
     '''
-    Returns chemical setup with system, specs, solver for Mg
+    Returns logK3, logK9, logK16 of the analytical setup for DIV at Temp [K] and totP [bar]
     '''
-    db = SupcrtDatabase('supcrtbl')
+    db = _database()
 
-    solution = AqueousPhase(['H2O(aq)','CO2(aq)', 'HCO3-', 'CO3-2', 'H+', 'OH-', 'Mg+2', 'SiO2(aq)'])
-    solution.setActivityModel(chain(
-        ActivityModelHKF(),
-        ActivityModelDrummond('CO2(aq)'),
-    ))
-
-    gases = GaseousPhase(['CO2(g)', 'N2(g)'])
-    gases.setActivityModel(ActivityModelPengRobinson())
+    rxn9 = db.reaction(LOGK_REACTIONS['logK9_'+DIV])
+    logK9 = rxn9.props(Temp, 'K', totP, 'bar').lgK[0]
 
-    minerals = MineralPhases(['Magnesite', 'Clino-Enstatite', 'Quartz'])
+    rxn15 = db.reaction(LOGK_REACTIONS['logK16'])
+    logK16 = rxn15.props(Temp, 'K', totP, 'bar').lgK[0]
 
-    system = ChemicalSystem(db, solution, gases, minerals)
+    rxn3= db.reaction(LOGK_REACTIONS['logK3'])
+    logK3 = rxn3.props(Temp, 'K', totP, 'bar').lgK[0]
+    
+    return logK3, logK9, logK16
 
-    specs = EquilibriumSpecs(system)
-    specs.temperature()
-    specs.pressure()
-    specs.fugacity('CO2')
+def setup_an_Ca(Temp, totP):
+    '''
+    Returns chemical analytical setup with system, specs, solver for Ca
+    '''
+    return _setup_an('Ca', Temp, totP)
 
-    solver = EquilibriumSolver(specs)
-    
-    return system, specs, solver
+def setup_an_Mg(Temp, totP):
+    '''
+    Returns logK3, logK9, logK16 of the analytical setup for Mg
+    '''
+    return _setup_an('Mg', Temp, totP)
 
-def setup_Fe():
+def setup_an_Fe(Temp, totP):
     '''
-    Returns chemical setup with system, specs, solver for Fe
+    Returns logK3, logK9, logK16 of the analytical setup for Fe
     '''
-    db = SupcrtDatabase('supcrtbl')
+    return _setup_an('Fe', Temp, totP)
 
-    solution = AqueousPhase(['H2O(aq)','CO2(aq)', 'HCO3-', 'CO3-2', 'H+', 'OH-', 'Fe+2', 'SiO2(aq)'])
-    solution.setActivityModel(chain(
-        ActivityModelHKF(),
-        ActivityModelDrummond('CO2(aq)'),
-    ))
+def logK_table(numT = LOGK_DEFAULTS["numT"], numP = LOGK_DEFAULTS["numP"], path = LOGK_DEFAULTS["path"]):
+    '''
+    Returns Temps [K], totPs [bar] and logK tables of LOGK_REACTIONS over the GRID_DEFAULTS ranges,
+    read from path if it holds the same grid, reactions, Reaktoro version and database, otherwise computed
+    and saved to path
+    '''
+    Temps = GRID_DEFAULTS["temps"](numT)
+    totPs = GRID_DEFAULTS["totps"](numP)
+    names = list(LOGK_REACTIONS)
+    reactions = [LOGK_REACTIONS[name] for name in names]
+    version = 'reaktoro %s, supcrtbl' % getattr(reaktoro, '__version__', 'unknown') # tables are stale after an upgrade
+
+    if path is not None and os.path.exists(path):
+        with np.load(path) as saved: # closed before the table may be saved to path again
+            if (saved['Temps'].shape == Temps.shape and np.allclose(saved['Temps'], Temps) and
+                    saved['totPs'].shape == totPs.shape and np.allclose(saved['totPs'], totPs) and
+                    list(saved['reactions']) == reactions and
+                    'version' in saved and str(saved['version']) == version):
+                return Temps, totPs, {name: saved[name] for name in names}
+
+    db = _database()
+    tables = {}
+    for name, reaction in zip(names, reactions):
+        rxn = db.reaction(reaction)
+        tables[name] = np.array([[rxn.props(Temp, 'K', totP, 'bar').lgK[0] for totP in totPs] for Temp in Temps])
+
+    if path is not None:
+        np.savez(path, Temps=Temps, totPs=totPs, reactions=np.array(reactions), version=version, **tables)
+
+    return Temps, totPs, tables
+
+def logK_an(DIV, Temp, totP):
+    '''
+    Returns logK3, logK9, logK16 for DIV interpolated from logK_table() at arrays of Temp [K] and totP [bar]
+    '''
+    if 'logK' not in _setups:
+        Temps, totPs, tables = logK_table()
+        _setups['logK'] = {name: RegularGridInterpolator((Temps, np.log10(totPs)), table)
+                           for name, table in tables.items()}
+    interps = _setups['logK']
 
-    gases = GaseousPhase(['CO2(g)', 'N2(g)'])
-    gases.setActivityModel(ActivityModelPengRobinson())
+    Temp, logP = np.broadcast_arrays(np.asarray(Temp, dtype=float), np.log10(totP))
+    points = np.stack([Temp.ravel(), logP.ravel()], axis=-1)
 
-    minerals = MineralPhases(['Siderite', 'Fayalite', 'Quartz'])
+    return tuple(interps[name](points).reshape(Temp.shape) for name in ['logK3', 'logK9_'+DIV, 'logK16'])
 
-    system = ChemicalSystem(db, solution, gases, minerals)
+def setup_Ca(minerals = None, cache_flag = True):
+    '''
+    Returns chemical setup with system, specs, solver for Ca
+    '''
+    return _setup('Ca', minerals = minerals, cache_flag = cache_flag)
 
-    specs = EquilibriumSpecs(system)
-    specs.temperature()
-    specs.pressure()
-    specs.fugacity('CO2')
+def setup_Mg(minerals = None, cache_flag = True):
+    '''
+    Returns chemical setup with system, specs, solver for Mg
+    '''
+    return _setup('Mg', minerals = minerals, cache_flag = cache_flag)
 
-    solver = EquilibriumSolver(specs)
-    
-    return system, specs, solver
+def setup_Fe(minerals = None, cache_flag = True):
+    '''
+    Returns chemical setup with system, specs, solver for Fe
+    '''
+    return _setup('Fe', minerals = minerals, cache_flag = cache_flag)
 
 
 # Solve Reaktoro ocean chemistry system
 
-def solve_Ca(system, specs, solver, addDIVtot, addSiO2, PCO2, Temp, totP):
+_system_names = weakref.WeakKeyDictionary() # species names of each chemical system, dropped with the system
+
+def _cache_key(DIV, system, addDIVtot, addSiO2, PCO2, Temp, totP):
     '''
-    Returns state for Ca
+    Returns cache key of an equilibrium point from its system, inputs and the Reaktoro version
     '''
-    state = ChemicalState(system)
-    state.setTemperature(Temp, 'K')
-    state.setPressure(totP, 'bar')
-    state.set('H2O(aq)', totH2O - addDIVtot, 'mol')     # add ~ one kg of water
-    state.set('N2(g)', totN2, 'mol')
-    state.set('HCO3-', 2*addDIVtot, 'mol')
-    state.set('Ca+2', addDIVtot, 'mol')
-    state.set('SiO2(aq)', addSiO2, 'mol')
+    if system not in _system_names:
+        _system_names[system] = [species.name() for species in system.species()]
+    names = _system_names[system]
+    return point_key(DIV, names, addDIVtot, addSiO2, PCO2, Temp, totP, totH2O, totN2,
+                     getattr(reaktoro, '__version__', 'unknown'))
 
-    conditions = EquilibriumConditions(specs)
-    conditions.temperature(state.temperature())
-    conditions.pressure(state.pressure())
-    conditions.fugacity('CO2', PCO2, 'bar')
+FALLBACKS = ['direct', 'neighbour', 'maxiters', 'substep'] # retry stages of a failed solve, in order
 
-    result = solver.solve(state, conditions)
+class SolveResult:
+    '''
+    Convergence, solver iterations, wall time [s] and retry stage (index of FALLBACKS) of one equilibrium solve,
+    or of a point served from the memo or cache without a solve if cached is True
+    '''
+    def __init__(self, succeeded, iterations, seconds, fallback = 0, cached = False):
+        self._succeeded = bool(succeeded)
+        self._iterations = int(iterations)
+        self._seconds = seconds
+        self._fallback = fallback
+        self._cached = cached
 
-    return state
+    def succeeded(self):
+        return self._succeeded
+
+    def iterations(self):
+        return self._iterations
+
+    def seconds(self):
+        return self._seconds
 
-def solve_Mg(system, specs, solver, addDIVtot, addSiO2, PCO2, Temp, totP):
+    def fallback(self):
+        return self._fallback
+
+    def cached(self):
+        return self._cached
+
+def _conditions(specs, state, PCO2, Temp, totP):
     '''
-    Returns state for Mg
+    Returns equilibrium conditions at PCO2 [bar], Temp [K] and totP [bar] with the element amounts of state
     '''
-    state = ChemicalState(system)
+    conditions = EquilibriumConditions(specs)
+    conditions.temperature(Temp, 'K')
+    conditions.pressure(totP, 'bar')
+    conditions.fugacity('CO2', PCO2, 'bar')
+    conditions.setInitialComponentAmountsFromState(state)
+    return conditions
+
+def _warm(state0, Temp, totP):
+    '''
+    Returns copy of the converged state0 at Temp [K] and totP [bar] to start a solve from
+    '''
+    state = ChemicalState(state0)
     state.setTemperature(Temp, 'K')
     state.setPressure(totP, 'bar')
-    state.set('H2O(aq)', totH2O - addDIVtot, 'mol')     # add ~ one kg of water
-    state.set('N2(g)', totN2, 'mol')
-    state.set('HCO3-', 2*addDIVtot, 'mol')
-    state.set('Mg+2', addDIVtot, 'mol')
-    state.set('SiO2(aq)', addSiO2, 'mol')
+    return state
 
-    conditions = EquilibriumConditions(specs)
-    conditions.temperature(state.temperature())
-    conditions.pressure(state.pressure())
-    conditions.fugacity('CO2', PCO2, 'bar')
+_solver_options = weakref.WeakKeyDictionary() # options set on each solver with set_solver_options
 
-    result = solver.solve(state, conditions)
+def set_solver_options(solver, options):
+    '''
+    Sets EquilibriumOptions on a solver, e.g. a cached one of setup_Ca/Mg/Fe, and keeps them so that
+    retries of failed solves restore them
+    '''
+    _solver_options[solver] = options
+    solver.setOptions(options)
 
-    return state
+def _options(solver):
+    '''
+    Returns the options set on solver with set_solver_options, or the default options
+    '''
+    if solver in _solver_options:
+        return _solver_options[solver]
+    return EquilibriumOptions()
 
-def solve_Fe(system, specs, solver, addDIVtot, addSiO2, PCO2, Temp, totP):
+def _retry(specs, solver, cold, PCO2, Temp, totP, good):
     '''
-    Returns state for Fe
+    Returns state, result, total iterations and stage (index of FALLBACKS) of the first retry that converges
+    for the failed point with initial state cold, from the last converged point of the sweep in good
     '''
+    iterations = 0
+    conditions = _conditions(specs, cold, PCO2, Temp, totP)
+
+    if 'state' in good: # the neighbour converged, so its state is close to this one
+        state = _warm(good['state'], Temp, totP)
+        result = solver.solve(state, conditions)
+        iterations = iterations + result.iterations()
+        if result.succeeded():
+            return state, result, iterations, 1
+
+    options = EquilibriumOptions()
+    options.optima.maxiters = RETRY_DEFAULTS["maxiters"]
+    saved = _options(solver) # of the caller, restored after the retries
+    solver.setOptions(options)
+    try:
+        state = ChemicalState(cold)
+        result = solver.solve(state, conditions)
+        iterations = iterations + result.iterations()
+        if result.succeeded() or 'state' not in good:
+            return state, result, iterations, 2
+
+        # walk geometrically in PCO2 and P from the neighbour, each step starting from the previous one
+        state = good['state']
+        for f in np.linspace(0, 1, RETRY_DEFAULTS["substeps"] + 1)[1:]:
+            PCO2_f = good['PCO2']**(1 - f) * PCO2**f
+            totP_f = good['totP']**(1 - f) * totP**f
+            state = _warm(state, Temp, totP_f)
+            result = solver.solve(state, _conditions(specs, cold, PCO2_f, Temp, totP_f))
+            iterations = iterations + result.iterations()
+            if not result.succeeded():
+                break
+        return state, result, iterations, 3
+    finally:
+        solver.setOptions(saved)
+
+def _solve(DIV, system, specs, solver, addDIVtot, addSiO2, PCO2, Temp, totP, state0 = None, result_flag = False,
+           good = None):
+    '''
+    Returns state for the divalent cation DIV, warm-started from state0 if given, and its SolveResult
+    if result_flag is True. If good is a dictionary, failed solves are retried and good keeps the state,
+    PCO2 and totP of the last converged point
+    '''
+    start = time.perf_counter()
+    memo = active_memo()
+    cache = active_cache()
+    if memo is not None or cache is not None:
+        key = _cache_key(DIV, system, addDIVtot, addSiO2, PCO2, Temp, totP)
+        amounts = memo.get(key) if memo is not None else None
+        if amounts is None and cache is not None:
+            amounts = cache.get(key)
+            if amounts is not None and memo is not None:
+                memo.put(key, amounts)
+        if amounts is not None:
+            state = ChemicalState(system)
+            state.setTemperature(Temp, 'K')
+            state.setPressure(totP, 'bar')
+            state.setSpeciesAmounts(amounts)
+            if good is not None:
+                good.update(state = state, PCO2 = PCO2, totP = totP)
+            if result_flag == True:
+                return state, SolveResult(True, 0, time.perf_counter() - start, cached = True)
+            return state
+
     state = ChemicalState(system)
     state.setTemperature(Temp, 'K')
     state.setPressure(totP, 'bar')
     state.set('H2O(aq)', totH2O - addDIVtot, 'mol')     # add ~ one kg of water
     state.set('N2(g)', totN2, 'mol')
     state.set('HCO3-', 2*addDIVtot, 'mol')
-    state.set('Fe+2', addDIVtot, 'mol')
+    state.set(DIV+'+2', addDIVtot, 'mol')
     state.set('SiO2(aq)', addSiO2, 'mol')
+    cold = ChemicalState(state) if good is not None else None # the solver overwrites state
 
     conditions = EquilibriumConditions(specs)
     conditions.temperature(state.temperature())
     conditions.pressure(state.pressure())
     conditions.fugacity('CO2', PCO2, 'bar')
 
+    if state0 is not None: # continuation: keep the element amounts of this point, start from the converged state0
+        conditions.setInitialComponentAmountsFromState(state)
+        state = _warm(state0, Temp, totP)
+
     result = solver.solve(state, conditions)
+    iterations = result.iterations()
+    fallback = 0
+
+    if good is not None and not result.succeeded():
+        state, result, retried, fallback = _retry(specs, solver, cold, PCO2, Temp, totP, good)
+        iterations = iterations + retried
+
+    if result.succeeded():
+        if memo is not None or cache is not None:
+            amounts = species_amounts(state)
+        if memo is not None:
+            memo.put(key, amounts)
+        if cache is not None:
+            cache.put(key, amounts)
+        if good is not None:
+            good.update(state = state, PCO2 = PCO2, totP = totP)
+
+    if result_flag == True:
+        return state, SolveResult(result.succeeded(), iterations, time.perf_counter() - start, fallback)
 
     return state
+
+def solve_Ca(system, specs, solver, addDIVtot, addSiO2, PCO2, Temp, totP, state0 = None, result_flag = False,
+             good = None):
+    '''
+    Returns state for Ca
+    '''
+    return _solve('Ca', system, specs, solver, addDIVtot, addSiO2, PCO2, Temp, totP,
+                  state0 = state0, result_flag = result_flag, good = good)
+
+def solve_Mg(system, specs, solver, addDIVtot, addSiO2, PCO2, Temp, totP, state0 = None, result_flag = False,
+             good = None):
+    '''
+    Returns state for Mg
+    '''
+    return _solve('Mg', system, specs, solver, addDIVtot, addSiO2, PCO2, Temp, totP,
+                  state0 = state0, result_flag = result_flag, good = good)
+
+def solve_Fe(system, specs, solver, addDIVtot, addSiO2, PCO2, Temp, totP, state0 = None, result_flag = False,
+             good = None):
+    '''
+    Returns state for Fe
+    '''
+    return _solve('Fe', system, specs, solver, addDIVtot, addSiO2, PCO2, Temp, totP,
+                  state0 = state0, result_flag = result_flag, good = good)
@@ -11,6 +11,8 @@
 
 # Import libraries
 
+from collections import namedtuple
+
 import numpy as np
 from astropy.constants import R
 
@@ -49,6 +51,36 @@ def ocean_pH_low(PCO2, logK3):
     pH = -0.5 * (np.log10(PCO2) + logK3)
     return pH
 
+def ccd_depths(nCarb, totPs, fraction = 0.001):
+    '''
+    Returns CCDs [km] from carbonate amounts nCarb of shape (..., totnum) along the pressures totPs [bar] of
+    each ocean column, with the crossing of the dissolution threshold, fraction of the surface carbonate,
+    interpolated linearly in log10(P)
+    '''
+    nCarb = np.asarray(nCarb, dtype = np.float64)
+    logPs = np.log10(totPs)
+    nCarb_surf = nCarb[..., :1]
+    threshold = fraction * nCarb_surf
+
+    below = nCarb < threshold # False at unsolved (NaN) pressures
+    j1 = np.argmax(below, axis = -1)[..., None] # first pressure below the threshold
+    j0 = np.maximum(j1 - 1, 0)
+    n0 = np.take_along_axis(nCarb, j0, axis = -1)
+    n1 = np.take_along_axis(nCarb, j1, axis = -1)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        frac = np.nan_to_num(np.clip((n0 - threshold) / (n0 - n1), 0, 1))
+    logPc = logPs[j0] + frac * (logPs[j1] - logPs[j0])
+
+    CCDs = np.where(below.any(axis = -1, keepdims = True), ocean_depth(10**logPc), 100) # km
+    CCDs = np.where(nCarb_surf < low_cutoff, 1e-3, CCDs) # 0 # km
+    return CCDs[..., 0]
+
+def ccd_depth(nCarb, totPs, fraction = 0.001):
+    '''
+    Returns CCD [km] from carbonate amounts nCarb along the pressures totPs [bar] of an ocean column
+    '''
+    return float(ccd_depths(nCarb, totPs, fraction = fraction))
+
 def weath_scaling(PCO2, T, beta = 0.3, Ea = 31e3, delT = 13.7):
     '''
     Returns scaling in the divalent cation number density due to weathering
@@ -68,77 +100,203 @@ def weath_scaling(PCO2, T, beta = 0.3, Ea = 31e3, delT = 13.7):
 
 # Custom dictionary objects to save chemical species as number density [dm^-3]
 
-def chem_dict1(totnum):
+ALL_SPECIES = ['Ca+2', 'Mg+2', 'Fe+2', 'H+', 'Na+', 'K+', 'OH-', 'HCO3-', 'CO3-2', 'Cl-', 'CO2(aq)', 'CO2(g)',
+               'PCO2', 'SiO2(aq)', 'ALK', 'DIC', 'Calcite', 'Magnesite', 'Siderite', 'Dolomite', 'Wollastonite',
+               'Lime', 'Clino-Enstatite', 'Ferrosilite', 'Antigorite', 'Fayalite', 'SiO2(a)', 'Quartz',
+               'Chalcedony', 'Cristobalite', 'Coesite', 'Diopside', 'pH']
+
+SPECIES = { # species filled by the save_chems functions of each carbonate system
+    'Ca': ['Ca+2', 'H+', 'OH-', 'CO3-2', 'HCO3-', 'SiO2(aq)', 'CO2(aq)', 'CO2(g)', 'PCO2',
+           'Calcite', 'Wollastonite', 'Quartz', 'pH'],
+    'Mg': ['Mg+2', 'H+', 'OH-', 'CO3-2', 'HCO3-', 'SiO2(aq)', 'CO2(aq)', 'CO2(g)', 'PCO2',
+           'Magnesite', 'Clino-Enstatite', 'Quartz', 'pH'],
+    'Fe': ['Fe+2', 'H+', 'OH-', 'CO3-2', 'HCO3-', 'SiO2(aq)', 'CO2(aq)', 'CO2(g)', 'PCO2',
+           'Siderite', 'Fayalite', 'Quartz', 'pH'],
+}
+
+def map_species(carb):
+    '''
+    Returns species of the (T, PCO2) maps of a CCD sweep of the carbonate carb
+    '''
+    return ['pH', 'HCO3-', 'CO3-2', 'CO2(aq)', 'SiO2(aq)', carb]
+
+class ChemDict:
+    '''
+    Chemical Dictionary Object with dictionary-style access to rows of one contiguous array
+    '''
+    def __init__(self, names, shape, dtype = np.float64):
+        self.names = list(names)
+        self.index = {name: m for m, name in enumerate(self.names)}
+        self.data = np.zeros((len(self.names),) + tuple(shape), dtype = dtype)
+        self._rows = {}
+
+    def __getitem__(self, name):
+        return self.data[self.index[name]]
+
+    def __setitem__(self, name, value):
+        self.data[self.index[name]] = value
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def keys(self):
+        return list(self.names)
+
+    def items(self):
+        return [(name, self[name]) for name in self.names]
+
+    def rows(self, names):
+        '''
+        Returns array of the rows of names in self.data, resolved once per list of names
+        '''
+        key = tuple(names)
+        if key not in self._rows:
+            self._rows[key] = np.array([self.index[name] for name in names], dtype = int)
+        return self._rows[key]
+
+def chem_dict(shape, DIV = None, dtype = np.float64):
+    '''
+    Returns Chemical Dictionary Object of the given shape with the species of DIV, or all species if DIV is None
+    '''
+    if DIV is None:
+        return ChemDict(ALL_SPECIES, shape, dtype = dtype)
+    return ChemDict(SPECIES[DIV], shape, dtype = dtype)
+
+def chem_dict1(totnum, DIV = None, dtype = np.float64):
     '''
     Returns 1D Chemical Dictionary Object to be used for Plotting
     '''
-    chem = {'Ca+2': np.zeros(totnum), 'Mg+2': np.zeros(totnum), 
-            'Fe+2': np.zeros(totnum), 'H+' : np.zeros(totnum),  
-            'Na+' : np.zeros(totnum), 'K+' : np.zeros(totnum), 
-            'OH-': np.zeros(totnum), 'HCO3-': np.zeros(totnum), 
-            'CO3-2': np.zeros(totnum), 'Cl-': np.zeros(totnum), 
-            'CO2(aq)': np.zeros(totnum), 'CO2(g)': np.zeros(totnum), 
-            'PCO2': np.zeros(totnum), 'SiO2(aq)': np.zeros(totnum),
-            'ALK': np.zeros(totnum), 'DIC': np.zeros(totnum), 
-            'Calcite': np.zeros(totnum), 'Magnesite': np.zeros(totnum), 
-            'Siderite': np.zeros(totnum), 'Dolomite': np.zeros(totnum), 
-            'Wollastonite': np.zeros(totnum), 'Lime': np.zeros(totnum), 
-            'Clino-Enstatite': np.zeros(totnum), 'Ferrosilite': np.zeros(totnum), 
-            'Antigorite': np.zeros(totnum), 'Fayalite': np.zeros(totnum), 
-            'SiO2(a)': np.zeros(totnum), 'Quartz': np.zeros(totnum), 
-            'Chalcedony': np.zeros(totnum), 'Cristobalite': np.zeros(totnum), 
-            'Coesite': np.zeros(totnum), 'Diopside': np.zeros(totnum), 
-            'pH': np.zeros(totnum)}
-
-    return chem
-
-def chem_dict2(numQ,totnum):
+    return chem_dict((totnum,), DIV = DIV, dtype = dtype)
+
+def chem_dict2(numQ, totnum, DIV = None, dtype = np.float64):
     '''
     Returns 2D Chemical Dictionary Object to be used for Plotting
     '''
-    chem = {'Ca+2': np.zeros((numQ,totnum)), 'Mg+2': np.zeros((numQ,totnum)), 
-            'Fe+2': np.zeros((numQ,totnum)), 'H+' : np.zeros((numQ,totnum)),  
-            'Na+' : np.zeros((numQ,totnum)), 'K+' : np.zeros((numQ,totnum)), 
-            'OH-': np.zeros((numQ,totnum)), 'HCO3-': np.zeros((numQ,totnum)), 
-            'CO3-2': np.zeros((numQ,totnum)), 'Cl-': np.zeros((numQ,totnum)), 
-            'CO2(aq)': np.zeros((numQ,totnum)), 'CO2(g)': np.zeros((numQ,totnum)), 
-            'PCO2': np.zeros((numQ,totnum)), 'SiO2(aq)': np.zeros((numQ,totnum)),
-            'ALK': np.zeros((numQ,totnum)), 'DIC': np.zeros((numQ,totnum)), 
-            'Calcite': np.zeros((numQ,totnum)), 'Magnesite': np.zeros((numQ,totnum)), 
-            'Siderite': np.zeros((numQ,totnum)), 'Dolomite': np.zeros((numQ,totnum)), 
-            'Wollastonite': np.zeros((numQ,totnum)), 'Lime': np.zeros((numQ,totnum)), 
-            'Clino-Enstatite': np.zeros((numQ,totnum)), 'Ferrosilite': np.zeros((numQ,totnum)), 
-            'Antigorite': np.zeros((numQ,totnum)), 'Fayalite': np.zeros((numQ,totnum)), 
-            'SiO2(a)': np.zeros((numQ,totnum)), 'Quartz': np.zeros((numQ,totnum)), 
-            'Chalcedony': np.zeros((numQ,totnum)), 'Cristobalite': np.zeros((numQ,totnum)), 
-            'Coesite': np.zeros((numQ,totnum)), 'Diopside': np.zeros((numQ,totnum)), 
-            'pH': np.zeros((numQ,totnum))}
-
-    return chem
-
-def chem_dict3(numQ1,numQ2,totnum):
+    return chem_dict((numQ, totnum), DIV = DIV, dtype = dtype)
+
+def chem_dict3(numQ1, numQ2, totnum, DIV = None, dtype = np.float64):
     '''
     Returns 3D Chemical Dictionary Object to be used for Plotting
     '''
-    chem = {'Ca+2': np.zeros((numQ1,numQ2,totnum)), 'Mg+2': np.zeros((numQ1,numQ2,totnum)), 
-            'Fe+2': np.zeros((numQ1,numQ2,totnum)), 'H+' : np.zeros((numQ1,numQ2,totnum)),  
-            'Na+' : np.zeros((numQ1,numQ2,totnum)), 'K+' : np.zeros((numQ1,numQ2,totnum)), 
-            'OH-': np.zeros((numQ1,numQ2,totnum)), 'HCO3-': np.zeros((numQ1,numQ2,totnum)), 
-            'CO3-2': np.zeros((numQ1,numQ2,totnum)), 'Cl-': np.zeros((numQ1,numQ2,totnum)), 
-            'CO2(aq)': np.zeros((numQ1,numQ2,totnum)), 'CO2(g)': np.zeros((numQ1,numQ2,totnum)), 
-            'PCO2': np.zeros((numQ1,numQ2,totnum)), 'SiO2(aq)': np.zeros((numQ1,numQ2,totnum)),
-            'ALK': np.zeros((numQ1,numQ2,totnum)), 'DIC': np.zeros((numQ1,numQ2,totnum)), 
-            'Calcite': np.zeros((numQ1,numQ2,totnum)), 'Magnesite': np.zeros((numQ1,numQ2,totnum)), 
-            'Siderite': np.zeros((numQ1,numQ2,totnum)), 'Dolomite': np.zeros((numQ1,numQ2,totnum)), 
-            'Wollastonite': np.zeros((numQ1,numQ2,totnum)), 'Lime': np.zeros((numQ1,numQ2,totnum)), 
-            'Clino-Enstatite': np.zeros((numQ1,numQ2,totnum)), 'Ferrosilite': np.zeros((numQ1,numQ2,totnum)), 
-            'Antigorite': np.zeros((numQ1,numQ2,totnum)), 'Fayalite': np.zeros((numQ1,numQ2,totnum)), 
-            'SiO2(a)': np.zeros((numQ1,numQ2,totnum)), 'Quartz': np.zeros((numQ1,numQ2,totnum)), 
-            'Chalcedony': np.zeros((numQ1,numQ2,totnum)), 'Cristobalite': np.zeros((numQ1,numQ2,totnum)), 
-            'Coesite': np.zeros((numQ1,numQ2,totnum)), 'Diopside': np.zeros((numQ1,numQ2,totnum)), 
-            'pH': np.zeros((numQ1,numQ2,totnum))}
-
-    return chem
+    return chem_dict((numQ1, numQ2, totnum), DIV = DIV, dtype = dtype)
+
+
+# Record convergence, solver iterations and wall time of equilibrium solves
+
+STATS = ['success', 'iterations', 'seconds', 'solves', 'fallback']
+
+def stats_dict(shape):
+    '''
+    Returns Dictionary Object of solver statistics of the given shape, NaN where nothing was solved
+    '''
+    stats = ChemDict(STATS, shape)
+    stats.data[...] = np.nan
+    return stats
+
+def stats_record(result):
+    '''
+    Returns array of success, iterations, wall time [s], one solve and retry stage of a SolveResult,
+    or of no solve for a point served from the memo or cache
+    '''
+    if result.cached():
+        return np.array([np.nan, 0, 0, 0, 0])
+    return np.array([result.succeeded(), result.iterations(), result.seconds(), 1, result.fallback()])
+
+def save_stats(result, stats, index):
+    '''
+    Returns stats dictionary object by updating stats[index] with the SolveResult of one solve
+    '''
+    stats.data[(slice(None),) + index] = stats_record(result)
+    return stats
+
+def reduce_stats(records):
+    '''
+    Returns array of the fraction of successful solves, total iterations, total wall time [s],
+    number of solves and latest retry stage of an array of stats records
+    '''
+    records = np.reshape(records, (-1, len(STATS)))
+    solved = records[records[:, 3] > 0] # points served from the memo or cache are no solves
+    if len(solved) == 0:
+        return np.array([np.nan, 0, 0, 0, 0])
+    return np.array([np.mean(solved[:, 0]), np.sum(solved[:, 1]), np.sum(solved[:, 2]), np.sum(solved[:, 3]),
+                     np.max(solved[:, 4])])
+
+
+# Extract chemical species from a solved state in one bulk read
+
+_species_index = {} # indices of the species of SPECIES[DIV] in a chemical system, keyed by DIV and its species
+
+def clear_species_index():
+    '''
+    Invalidates the species indices resolved by species_record
+    '''
+    _species_index.clear()
+
+def species_amounts(state):
+    '''
+    Returns the amounts [mol] of all species of a state as a NumPy array
+    '''
+    n = state.speciesAmounts()
+    if hasattr(n, 'asarray'):
+        n = n.asarray()
+    return np.asarray(n, dtype = float)
+
+def species_record(state, PCO2, DIV):
+    '''
+    Returns array of the SPECIES[DIV] quantities of a state, in units of number density [dm^-3] with PCO2 and pH
+    '''
+    names = SPECIES[DIV]
+    species = state.system().species() # a copy of the system for each state, so keyed by its species names
+    key = (DIV, tuple(sp.name() for sp in species))
+    if key not in _species_index:
+        amount_rows = [m for m, name in enumerate(names) if name not in ('PCO2', 'pH')]
+        _species_index[key] = (np.array(amount_rows), np.array([species.index(names[m]) for m in amount_rows]),
+                               species.index('H+'), names.index('PCO2'), names.index('pH'))
+    amount_rows, amount_index, iH, iPCO2, ipH = _species_index[key]
+
+    n = species_amounts(state)
+    record = np.empty(len(names))
+    record[amount_rows] = numden * n[amount_index]
+    record[iPCO2] = PCO2
+    record[ipH] = -np.log10(n[iH])
+
+    return record
+
+def save_chems(state, PCO2, chems, DIV, index):
+    '''
+    Returns chems dictionary object for DIV by updating chems[index] with one fancy-indexed assignment
+    '''
+    chems.data[(chems.rows(SPECIES[DIV]),) + index] = species_record(state, PCO2, DIV)
+    return chems
+
+
+# Compact records of solved points for streaming
+
+class Point(namedtuple('Point', ['DIV', 'index', 'PCO2', 'Temp', 'totP', 'record', 'stats'])):
+    '''
+    Solved point with its grid index, inputs PCO2 [bar], Temp [K] and totP [bar], the SPECIES[DIV]
+    quantities of species_record in record and the STATS of its solve in stats
+    '''
+    __slots__ = ()
+
+    def species(self, name):
+        return self.record[SPECIES[self.DIV].index(name)]
+
+def save_point(point, chems, stats = None):
+    '''
+    Returns chems dictionary object by updating chems[point.index] with the species of point,
+    and updates stats[point.index] with its solver statistics if stats is given
+    '''
+    chems.data[(chems.rows(SPECIES[point.DIV]),) + point.index] = point.record
+    if stats is not None:
+        stats.data[(slice(None),) + point.index] = point.stats
+    return chems
 
 
 # Save chemical species in 1D dictionary objects in units of number density [dm^-3] 
@@ -147,67 +305,19 @@ def save_chems1_Ca(state, PCO2, chems1, j):
     '''
     Returns chems1 dictionary object for Ca by updating chems1[j]
     '''    
-    chems1['Ca+2'][j] = numden*state.speciesAmount('Ca+2')[0]
-    chems1['H+'][j] = numden*state.speciesAmount('H+')[0]
-    chems1['OH-'][j] = numden*state.speciesAmount('OH-')[0]
-    chems1['CO3-2'][j] = numden*state.speciesAmount('CO3-2')[0]
-    chems1['HCO3-'][j] = numden*state.speciesAmount('HCO3-')[0]
-    chems1['SiO2(aq)'][j] = numden*state.speciesAmount('SiO2(aq)')[0]
-
-    chems1['CO2(aq)'][j] = numden*state.speciesAmount('CO2(aq)')[0]
-    chems1['CO2(g)'][j] = numden*state.speciesAmount('CO2(g)')[0]
-    chems1['PCO2'][j] = PCO2
-
-    chems1['Calcite'][j] = numden*state.speciesAmount('Calcite')[0]
-    chems1['Wollastonite'][j] = numden*state.speciesAmount('Wollastonite')[0]
-
-    chems1['pH'][j] = -np.log10(state.speciesAmount('H+')[0])
-    
-    return chems1
+    return save_chems(state, PCO2, chems1, 'Ca', (j,))
 
 def save_chems1_Mg(state, PCO2, chems1, j):
     '''
     Returns chems1 dictionary object for Mg by updating chems1[j]
     '''  
-    chems1['Mg+2'][j] = numden*state.speciesAmount('Mg+2')[0]
-    chems1['H+'][j] = numden*state.speciesAmount('H+')[0]
-    chems1['OH-'][j] = numden*state.speciesAmount('OH-')[0]
-    chems1['CO3-2'][j] = numden*state.speciesAmount('CO3-2')[0]
-    chems1['HCO3-'][j] = numden*state.speciesAmount('HCO3-')[0]
-    chems1['SiO2(aq)'][j] = numden*state.speciesAmount('SiO2(aq)')[0]
-
-    chems1['CO2(aq)'][j] = numden*state.speciesAmount('CO2(aq)')[0]
-    chems1['CO2(g)'][j] = numden*state.speciesAmount('CO2(g)')[0]
-    chems1['PCO2'][j] = PCO2
-
-    chems1['Magnesite'][j] = numden*state.speciesAmount('Magnesite')[0]
-    chems1['Clino-Enstatite'][j] = numden*state.speciesAmount('Clino-Enstatite')[0]
-
-    chems1['pH'][j] = -np.log10(state.speciesAmount('H+')[0])
-            
-    return chems1
+    return save_chems(state, PCO2, chems1, 'Mg', (j,))
 
 def save_chems1_Fe(state, PCO2, chems1, j):
     '''
     Returns chems1 dictionary object for Fe by updating chems1[j]
     '''  
-    chems1['Fe+2'][j] = numden*state.speciesAmount('Fe+2')[0]
-    chems1['H+'][j] = numden*state.speciesAmount('H+')[0]
-    chems1['OH-'][j] = numden*state.speciesAmount('OH-')[0]
-    chems1['CO3-2'][j] = numden*state.speciesAmount('CO3-2')[0]
-    chems1['HCO3-'][j] = numden*state.speciesAmount('HCO3-')[0]
-    chems1['SiO2(aq)'][j] = numden*state.speciesAmount('SiO2(aq)')[0]
-
-    chems1['CO2(aq)'][j] = numden*state.speciesAmount('CO2(aq)')[0]
-    chems1['CO2(g)'][j] = numden*state.speciesAmount('CO2(g)')[0]
-    chems1['PCO2'][j] = PCO2
-
-    chems1['Siderite'][j] = numden*state.speciesAmount('Siderite')[0]
-    chems1['Fayalite'][j] = numden*state.speciesAmount('Fayalite')[0]
-
-    chems1['pH'][j] = -np.log10(state.speciesAmount('H+')[0])
-            
-    return chems1
+    return save_chems(state, PCO2, chems1, 'Fe', (j,))
 
 
 # Save chemical species in 2D dictionary objects in units of number density [dm^-3] 
@@ -228,70 +338,19 @@ def save_chems2_Ca(state, PCO2, chems2, i, j):
     '''
     Returns chems2 dictionary object for Ca by updating chems2[i][j] 
     '''
-    chems2['Ca+2'][i][j] = numden*state.speciesAmount('Ca+2')[0]
-    chems2['H+'][i][j] = numden*state.speciesAmount('H+')[0]
-    chems2['OH-'][i][j] = numden*state.speciesAmount('OH-')[0]
-    chems2['CO3-2'][i][j] = numden*state.speciesAmount('CO3-2')[0]
-    chems2['HCO3-'][i][j] = numden*state.speciesAmount('HCO3-')[0]
-    chems2['SiO2(aq)'][i][j] = numden*state.speciesAmount('SiO2(aq)')[0]
-
-    chems2['CO2(aq)'][i][j] = numden*state.speciesAmount('CO2(aq)')[0]
-    chems2['CO2(g)'][i][j] = numden*state.speciesAmount('CO2(g)')[0]
-    chems2['PCO2'][i][j] = PCO2
-
-    chems2['Calcite'][i][j] = numden*state.speciesAmount('Calcite')[0]
-    chems2['Wollastonite'][i][j] = numden*state.speciesAmount('Wollastonite')[0]
-    chems2['Quartz'][i][j] = numden*state.speciesAmount('Quartz')[0]
-
-    chems2['pH'][i][j] = -np.log10(state.speciesAmount('H+')[0])
-    
-    return chems2
+    return save_chems(state, PCO2, chems2, 'Ca', (i, j))
 
 def save_chems2_Mg(state, PCO2, chems2, i, j):
     '''
     Returns chems2 dictionary object for Mg by updating chems2[i][j] 
     '''
-    chems2['Mg+2'][i][j] = numden*state.speciesAmount('Mg+2')[0]
-    chems2['H+'][i][j] = numden*state.speciesAmount('H+')[0]
-    chems2['OH-'][i][j] = numden*state.speciesAmount('OH-')[0]
-    chems2['CO3-2'][i][j] = numden*state.speciesAmount('CO3-2')[0]
-    chems2['HCO3-'][i][j] = numden*state.speciesAmount('HCO3-')[0]
-    chems2['SiO2(aq)'][i][j] = numden*state.speciesAmount('SiO2(aq)')[0]
-
-    chems2['CO2(aq)'][i][j] = numden*state.speciesAmount('CO2(aq)')[0]
-    chems2['CO2(g)'][i][j] = numden*state.speciesAmount('CO2(g)')[0]
-    chems2['PCO2'][i][j] = PCO2
-
-    chems2['Magnesite'][i][j] = numden*state.speciesAmount('Magnesite')[0]
-    chems2['Clino-Enstatite'][i][j] = numden*state.speciesAmount('Clino-Enstatite')[0]
-    chems2['Quartz'][i][j] = numden*state.speciesAmount('Quartz')[0]
-
-    chems2['pH'][i][j] = -np.log10(state.speciesAmount('H+')[0])
-    
-    return chems2
+    return save_chems(state, PCO2, chems2, 'Mg', (i, j))
 
 def save_chems2_Fe(state, PCO2, chems2, i, j):
     '''
     Returns chems2 dictionary object for Fe by updating chems2[i][j] 
     '''
-    chems2['Fe+2'][i][j] = numden*state.speciesAmount('Fe+2')[0]
-    chems2['H+'][i][j] = numden*state.speciesAmount('H+')[0]
-    chems2['OH-'][i][j] = numden*state.speciesAmount('OH-')[0]
-    chems2['CO3-2'][i][j] = numden*state.speciesAmount('CO3-2')[0]
-    chems2['HCO3-'][i][j] = numden*state.speciesAmount('HCO3-')[0]
-    chems2['SiO2(aq)'][i][j] = numden*state.speciesAmount('SiO2(aq)')[0]
-
-    chems2['CO2(aq)'][i][j] = numden*state.speciesAmount('CO2(aq)')[0]
-    chems2['CO2(g)'][i][j] = numden*state.speciesAmount('CO2(g)')[0]
-    chems2['PCO2'][i][j] = PCO2
-
-    chems2['Siderite'][i][j] = numden*state.speciesAmount('Siderite')[0]
-    chems2['Fayalite'][i][j] = numden*state.speciesAmount('Fayalite')[0]
-    chems2['Quartz'][i][j] = numden*state.speciesAmount('Quartz')[0]
-
-    chems2['pH'][i][j] = -np.log10(state.speciesAmount('H+')[0])
-    
-    return chems2
+    return save_chems(state, PCO2, chems2, 'Fe', (i, j))
 
 
 # Save chemical species in 3D dictionary objects in units of number density [dm^-3] 
@@ -300,66 +359,16 @@ def save_chems3_Ca(state, PCO2, chems3, i, j, k):
     '''
     Returns chems3 dictionary object for Ca by updating chems3[k][i][j]
     '''    
-    chems3['Ca+2'][k][i][j] = numden*state.speciesAmount('Ca+2')[0]
-    chems3['H+'][k][i][j] = numden*state.speciesAmount('H+')[0]
-    chems3['OH-'][k][i][j] = numden*state.speciesAmount('OH-')[0]
-    chems3['CO3-2'][k][i][j] = numden*state.speciesAmount('CO3-2')[0]
-    chems3['HCO3-'][k][i][j] = numden*state.speciesAmount('HCO3-')[0]
-    chems3['SiO2(aq)'][k][i][j] = numden*state.speciesAmount('SiO2(aq)')[0]
-
-    chems3['CO2(aq)'][k][i][j] = numden*state.speciesAmount('CO2(aq)')[0]
-    chems3['CO2(g)'][k][i][j] = numden*state.speciesAmount('CO2(g)')[0]
-    chems3['PCO2'][k][i][j] = PCO2
-
-    chems3['Calcite'][k][i][j] = numden*state.speciesAmount('Calcite')[0]
-    chems3['Wollastonite'][k][i][j] = numden*state.speciesAmount('Wollastonite')[0]
-    chems3['Quartz'][k][i][j] = numden*state.speciesAmount('Quartz')[0]
-
-    chems3['pH'][k][i][j] = -np.log10(state.speciesAmount('H+')[0])
-    
-    return chems3
+    return save_chems(state, PCO2, chems3, 'Ca', (k, i, j))
 
 def save_chems3_Mg(state, PCO2, chems3, i, j, k):
     '''
     Returns chems3 dictionary object for Mg by updating chems3[k][i][j]
     '''    
-    chems3['Mg+2'][k][i][j] = numden*state.speciesAmount('Mg+2')[0]
-    chems3['H+'][k][i][j] = numden*state.speciesAmount('H+')[0]
-    chems3['OH-'][k][i][j] = numden*state.speciesAmount('OH-')[0]
-    chems3['CO3-2'][k][i][j] = numden*state.speciesAmount('CO3-2')[0]
-    chems3['HCO3-'][k][i][j] = numden*state.speciesAmount('HCO3-')[0]
-    chems3['SiO2(aq)'][k][i][j] = numden*state.speciesAmount('SiO2(aq)')[0]
-
-    chems3['CO2(aq)'][k][i][j] = numden*state.speciesAmount('CO2(aq)')[0]
-    chems3['CO2(g)'][k][i][j] = numden*state.speciesAmount('CO2(g)')[0]
-    chems3['PCO2'][k][i][j] = PCO2
-
-    chems3['Magnesite'][k][i][j] = numden*state.speciesAmount('Magnesite')[0]
-    chems3['Clino-Enstatite'][k][i][j] = numden*state.speciesAmount('Clino-Enstatite')[0]
-    chems3['Quartz'][k][i][j] = numden*state.speciesAmount('Quartz')[0]
-
-    chems3['pH'][k][i][j] = -np.log10(state.speciesAmount('H+')[0])
-    return chems3
+    return save_chems(state, PCO2, chems3, 'Mg', (k, i, j))
 
 def save_chems3_Fe(state, PCO2, chems3, i, j, k):
     '''
     Returns chems3 dictionary object for Fe by updating chems3[k][i][j]
     '''    
-    chems3['Fe+2'][k][i][j] = numden*state.speciesAmount('Fe+2')[0]
-    chems3['H+'][k][i][j] = numden*state.speciesAmount('H+')[0]
-    chems3['OH-'][k][i][j] = numden*state.speciesAmount('OH-')[0]
-    chems3['CO3-2'][k][i][j] = numden*state.speciesAmount('CO3-2')[0]
-    chems3['HCO3-'][k][i][j] = numden*state.speciesAmount('HCO3-')[0]
-    chems3['SiO2(aq)'][k][i][j] = numden*state.speciesAmount('SiO2(aq)')[0]
-
-    chems3['CO2(aq)'][k][i][j] = numden*state.speciesAmount('CO2(aq)')[0]
-    chems3['CO2(g)'][k][i][j] = numden*state.speciesAmount('CO2(g)')[0]
-    chems3['PCO2'][k][i][j] = PCO2
-
-    chems3['Siderite'][k][i][j] = numden*state.speciesAmount('Siderite')[0]
-    chems3['Fayalite'][k][i][j] = numden*state.speciesAmount('Fayalite')[0]
-    chems3['Quartz'][k][i][j] = numden*state.speciesAmount('Quartz')[0]
-
-    chems3['pH'][k][i][j] = -np.log10(state.speciesAmount('H+')[0])
-    return chems3
-
+    return save_chems(state, PCO2, chems3, 'Fe', (k, i, j))